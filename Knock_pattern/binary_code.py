@@ -7,6 +7,12 @@ import matplotlib.pyplot as plt
 from scipy.signal import find_peaks
 import argparse
 from play_and_record import int_or_str, audio_callback, record_audio
+from metrics import UNLOCK_STAGE_SECONDS
+import tracing
+import audio_capture
+from sensing_pool import pool
+from Knock_pattern.rhythm_match import (MAX_INTERVALS, MIN_INTERVALS, RhythmBatch, best_match, is_uniform,
+                                        normalize, onset_intervals, rhythm_from_password, usable_rhythm)
 
 
 # Global variables
@@ -17,6 +23,26 @@ min_silence = 0.1  # Minimum silence duration between knocks (seconds)
 min_knock_duration = 0.05  # Minimum knock duration (seconds)
 bit_threshold = 0.6  # Silence duration threshold for 0/1 (seconds)
 DATABASE = "binary_password.json"
+PAGE_LIMIT = 100  # Default number of entries returned per page
+# "binary" decodes gaps into a 0/1 string and looks for each password in it;
+# "rhythm" compares the gaps with every enrolled rhythm at once, independent of tempo
+MATCH_MODE = os.environ.get("KNOCK_MATCH_MODE", "binary")
+
+# Version counter, bumped whenever the database file changes
+database_version = 0
+database_file = None  # (inode, size, mtime) of the file the version above was counted for
+# Sorted active entries cached for the version above
+listing_cache = (None, [])
+# Rhythms of the active entries, batched for the version above: (version, RhythmBatch, entries)
+rhythm_cache = (None, RhythmBatch([]), [])
+# Id of the password matched by the last start_recording_knocks() call, for the access log
+matched_id = None
+
+# Stage latency histograms for start_recording_knocks()
+RECORD_AUDIO_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="record_audio")
+DETECT_KNOCKS_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="detect_knocks")
+DECODE_KNOCKS_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="decode_knocks")
+MATCH_RHYTHM_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="match_rhythm")
 
 ''' Database Related Codes '''
 def load_binary_database():
@@ -24,36 +50,154 @@ def load_binary_database():
         return json.load(f)
 
 
-def update_binary_database(data):
-    with open(DATABASE, 'w') as f:
-        json.dump(data, f, indent=2)
+def database_file_state():
+    """
+    Identifies one write of the database: every save swaps in a new file, so the inode
+    changes even when two writes land within the same coarse mtime tick
+    """
+    stat = os.stat(DATABASE)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
 
-def add_binary_password(id, name, expiration_time, knock_password, password):
+def update_binary_database(data):
+    global database_version, database_file
+    # Write to a temporary file and swap it in, so readers never see a half-written database
+    tmp_path = DATABASE + ".tmp"
+    with tracing.span("save_binary_database"):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, DATABASE)
+    database_version += 1
+    database_file = database_file_state()
+
+
+def get_database_version():
+    """Return the database version, also picking up writes made by other processes"""
+    global database_version, database_file
+    state = database_file_state()
+    if state != database_file:
+        database_file = state
+        database_version += 1
+    return database_version
+
+
+def query_binary_passwords(name=None, type=None, expiring_before=None, cursor=None, limit=PAGE_LIMIT):
+    """
+    Return one page of active passwords ordered by id, plus the cursor for the next page.
+    The cursor is the id of the last entry returned, or None when there are no more pages.
+    """
+    global listing_cache
+    version = get_database_version()
+    if listing_cache[0] != version:
+        data = load_binary_database()
+        active = [item for item in data if item["deletion_time"] is None]
+        active.sort(key=lambda item: item["id"])
+        listing_cache = (version, active)
+
+    if expiring_before is not None:
+        expiring_before = expiring_before.replace("T", " ")
+
+    page = []
+    next_cursor = None
+    for item in listing_cache[1]:
+        if cursor is not None and item["id"] <= cursor:
+            continue
+        if name is not None and name.lower() not in (item["name"] or "").lower():
+            continue
+        if type is not None and item.get("type") != type:
+            continue
+        if expiring_before is not None and (item["expiration_time"] is None or
+                                            item["expiration_time"].replace("T", " ") >= expiring_before):
+            continue
+        if len(page) == limit:
+            next_cursor = page[-1]["id"]
+            break
+        page.append(item)
+
+    return page, next_cursor
+
+
+def get_rhythm_batch():
+    """
+    The rhythms of all active entries as one RhythmBatch, rebuilt only when the database changes.
+    Entries enrolled by knocking carry a "rhythm" list of gaps; the rest use their 0/1 password.
+    """
+    global rhythm_cache
+    version = get_database_version()
+    if rhythm_cache[0] != version:
+        rhythms, entries = [], []
+        for item in load_binary_database():
+            if item["deletion_time"] is not None:
+                continue
+            rhythm = item.get("rhythm") or (rhythm_from_password(item["password"]) if item["password"] else [])
+            if usable_rhythm(rhythm):
+                rhythms.append(rhythm)
+                entries.append(item)
+        rhythm_cache = (version, RhythmBatch(rhythms), entries)
+    return rhythm_cache[1], rhythm_cache[2]
+
+
+def is_expired(item, now):
+    return item["expiration_time"] is not None and item["expiration_time"].replace("T", " ") <= now
+
+
+def match_rhythm(knocks):
+    """Id of the active, unexpired entry whose rhythm the knocks follow, or None"""
+    batch, entries = get_rhythm_batch()
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    usable = np.array([not is_expired(item, now) for item in entries], dtype=bool)
+    index, distance = best_match(onset_intervals(knocks, fs), batch, usable)
+    print(f"Rhythm distance: {distance:.3f}")
+    return None if index is None else entries[index]["id"]
+
+
+def enroll_rhythm(id, knocks):
+    """Store the rhythm of recorded knocks on an existing entry; False if it is unusable"""
+    rhythm = onset_intervals(knocks, fs)
+    if not usable_rhythm(rhythm):
+        return False
     data = load_binary_database()
+    found = False
+    for item in data:
+        if item["id"] == id and item["deletion_time"] is None:
+            item["rhythm"] = [round(float(gap), 4) for gap in normalize(rhythm)]
+            found = True
+    if found:
+        update_binary_database(data)
+    return found
 
-    # Add new password
-    new_password = {
+
+def new_binary_password(id, name, expiration_time, knock_password, password, type=None):
+    return {
         "id": id,
         "name": name,
         "password": password,
         "knock_password": knock_password,
+        "type": type,
         "creation_time": datetime.datetime.now().strftime('%Y-%m-%dT%H:%M'),
         "expiration_time": expiration_time,
         "deletion_time": None,
     }
 
+
+def add_binary_password(id, name, expiration_time, knock_password, password, type=None):
+    data = load_binary_database()
+
+    # Add new password
+    new_password = new_binary_password(id, name, expiration_time, knock_password, password, type)
+
     data.append(new_password)
     update_binary_database(data)
 
     return [item for item in data if item["deletion_time"] is None]
 
 
-def edit_binary_password(id, name, expiration_time, knock_password, password):
+def edit_binary_password(id, name, expiration_time, knock_password, password, type=None):
     data = load_binary_database()
     for item in data:
         if item["id"] == id:
             item["name"] = name
+            item["type"] = type
             item["knock_password"] = knock_password
             item["password"] = password
             item["expiration_time"] = expiration_time
@@ -74,6 +218,62 @@ def delete_binary_password(id):
     return [item for item in data if item["deletion_time"] is None]
 
 
+def prepare_binary_operations(operations):
+    """
+    Apply a list of add/edit/delete operations in order to the database in memory.
+    Each operation is a dict with an "op" key plus the fields of the matching single-entry call;
+    an edit only changes the fields it contains.
+    Returns (applied, results, save): results holds one {"id", "status", "detail"} dict per
+    operation, and save() writes the changed database once; only call it if applied.
+    """
+    data = load_binary_database()
+    active = {item["id"]: item for item in data if item["deletion_time"] is None}
+    results = []
+    now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M')
+
+    for operation in operations:
+        op = operation["op"]
+        id = operation.get("id")
+        error = None
+
+        if id is None:
+            error = "id is required"
+        elif op == "add":
+            if id in active:
+                error = f"id {id} already exists"
+            elif not operation.get("knock_password") or not operation.get("password"):
+                error = "knock_password and password are required"
+            else:
+                item = new_binary_password(id, operation.get("name"), operation.get("expiration_time"),
+                                           operation["knock_password"], operation["password"],
+                                           operation.get("type"))
+                data.append(item)
+                active[id] = item
+        elif op == "edit":
+            if id not in active:
+                error = f"id {id} not found"
+            elif any(field in operation and not operation[field] for field in ("knock_password", "password")):
+                error = "knock_password and password cannot be cleared"
+            else:
+                # Fields left out of the operation keep their stored value
+                item = active[id]
+                for field in ("name", "type", "knock_password", "password", "expiration_time"):
+                    if field in operation:
+                        item[field] = operation[field]
+        elif op == "delete":
+            if id not in active:
+                error = f"id {id} not found"
+            else:
+                active.pop(id)["deletion_time"] = now
+        else:
+            error = f"unknown operation '{op}'"
+
+        results.append({"id": id, "status": "error" if error else "ok", "detail": error})
+
+    applied = all(result["status"] == "ok" for result in results)
+    return applied, results, lambda: update_binary_database(data)
+
+
 ''' Detection Related Codes'''
 def detect_knocks(audio_data, channel=0):
     signal = audio_data[:, channel]
@@ -173,8 +373,8 @@ def audio_callback(indata, frames, time, status):
     accu_frames += frames
 
 
-def record_audio(duration, channels=1, device=None):
-    """Record audio for specified duration"""
+def record_audio(duration, channels=1, device=None, stop_event=None):
+    """Record audio for specified duration, or until stop_event is set"""
     global recording, accu_frames
     recording = np.zeros((int(fs * duration * 1.5), channels))  # Buffer with 50% extra
     accu_frames = 0
@@ -182,14 +382,23 @@ def record_audio(duration, channels=1, device=None):
     with sd.InputStream(device=device, channels=channels, samplerate=fs,
                         callback=audio_callback):
         print(f"Recording for {duration} seconds...")
-        sd.sleep(int(duration * 1000))
+        if stop_event is None:
+            sd.sleep(int(duration * 1000))
+        else:
+            stop_event.wait(duration)
 
     # Trim recording to actual length
     recording = recording[:accu_frames]
     return recording
 
 
-def start_recording_knocks():
+def start_recording_knocks(stop_event=None):
+    """
+    Check the knocks of the last few seconds plus the next 10 against the active passwords.
+    Setting stop_event ends the recording early and the attempt fails.
+    """
+    global matched_id
+    matched_id = None
     current_time = datetime.datetime.now()
     valid_passwords = []
 
@@ -218,14 +427,34 @@ def start_recording_knocks():
         # print(f"\nKnock detection password: {knock_password}")
         valid_passwords.append(password)
 
-    # Record audio
-    audio_data = record_audio(duration=10, channels=1, device=None)
+    # Record audio from the always-open microphone, starting with its pre-roll so knocks
+    # made just before the button press count too
+    with RECORD_AUDIO_SECONDS.time(), tracing.span("record_audio"):
+        audio_capture.capture.start()
+        audio_data = audio_capture.capture.record(duration=10, stop_event=stop_event)
+    if stop_event is not None and stop_event.is_set():
+        return False
 
     # Detect knocks
-    knocks = detect_knocks(audio_data, 0)
+    with DETECT_KNOCKS_SECONDS.time(), tracing.span("detect_knocks"):
+        knocks = pool.submit("detect_knocks", audio_data)
+
+    if MATCH_MODE == "rhythm":
+        with MATCH_RHYTHM_SECONDS.time(), tracing.span("match_rhythm"):
+            matched_id = match_rhythm(knocks)
+        print(f"Detected {len(knocks)} knocks, matched {matched_id}")
+        if matched_id is not None:
+            delete_binary_password(matched_id)  # Knock passwords are one-time
+            return True
+        # All-0 and all-1 passwords without a recorded rhythm are checked bit by bit instead
+        uniform = {item["password"] for item in data if not item.get("rhythm") and is_uniform(item["password"])}
+        valid_passwords = [password for password in valid_passwords if password in uniform]
+        if not valid_passwords:
+            return False
 
     # Decode to binary based on silence between knocks
-    binary_str, durations = decode_knocks(knocks)
+    with DECODE_KNOCKS_SECONDS.time(), tracing.span("decode_knocks"):
+        binary_str, durations = decode_knocks(knocks)
 
     unlock = False
     for password in valid_passwords:
@@ -235,8 +464,10 @@ def start_recording_knocks():
 
             for item in data:
                 # Delete the password after use
-                if item["password"] == password:
+                if item["password"] == password and item["deletion_time"] is None:
                     item["deletion_time"] = current_time.strftime("%Y-%m-%d %H:%M:%S")
+                    matched_id = item["id"]
+            update_binary_database(data)
 
             break
 
@@ -262,6 +493,8 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--duration', type=float, default=10.0, help='Recording duration')
     parser.add_argument('-b', '--bit-threshold', type=float, default=0.6,
                         help='Silence duration threshold for 0/1 (seconds)')
+    parser.add_argument('--enroll-rhythm', type=int, metavar='ID',
+                        help='Record a knocked rhythm and store it on password ID for rhythm matching')
     args = parser.parse_args()
 
     if args.list_devices:
@@ -276,6 +509,15 @@ if __name__ == '__main__':
     # Record audio
     audio_data = record_audio(args.duration, args.channels, args.input_device)
 
+    if args.enroll_rhythm is not None:
+        knocks = detect_knocks(audio_data, 0)
+        if enroll_rhythm(args.enroll_rhythm, knocks):
+            print(f"Stored a rhythm of {len(knocks)} knocks on password {args.enroll_rhythm}")
+        else:
+            print(f"Not stored: need an active password {args.enroll_rhythm} and "
+                  f"{MIN_INTERVALS + 1} to {MAX_INTERVALS + 1} knocks, got {len(knocks)}")
+        exit()
+
     # Process each channel
     for channel in range(audio_data.shape[1]):
         # Detect knocks
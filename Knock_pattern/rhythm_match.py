@@ -0,0 +1,105 @@
+import numpy as np
+
+# Configuration
+MIN_INTERVALS = 4  # Shortest enrolled pattern; shorter ones fit by chance inside other knocking
+MAX_INTERVALS = 16  # Longest enrolled pattern, in gaps between knocks
+MAX_WINDOWS = 64  # Attempt intervals considered; an attempt rarely has more knocks than this
+RHYTHM_THRESHOLD = 0.2  # Highest mean deviation of a gap, relative to the mean gap, that still matches
+SHORT_GAP, LONG_GAP = 1.0, 2.0  # Relative gaps used to turn a 0/1 password into a rhythm
+
+
+def onset_intervals(knocks, samplerate):
+    """Seconds between the starts of successive knocks, from detect_knocks() output"""
+    starts = np.array([start for start, end, duration in knocks], dtype=np.float64)
+    return np.diff(starts) / samplerate
+
+
+def normalize(intervals):
+    """Divide by the mean gap, so the same rhythm knocked faster or slower looks the same"""
+    intervals = np.asarray(intervals, dtype=np.float32)
+    return intervals / intervals.mean()
+
+
+def is_uniform(password):
+    """All-0 and all-1 passwords normalise to the same even rhythm, which any steady knocking fits"""
+    return len(set(password)) == 1
+
+
+def rhythm_from_password(password):
+    """
+    The rhythm a 0/1 knock password describes, for entries with no recorded rhythm;
+    empty for uniform passwords, which are left to the bit matcher
+    """
+    if is_uniform(password):
+        return np.zeros(0, dtype=np.float32)
+    return normalize([LONG_GAP if bit == "1" else SHORT_GAP for bit in password])
+
+
+def usable_rhythm(rhythm):
+    """Whether a rhythm has a number of gaps the matcher accepts"""
+    return MIN_INTERVALS <= len(rhythm) <= MAX_INTERVALS
+
+
+class RhythmBatch:
+    """
+    Enrolled rhythms, normalised and zero-padded into one (patterns, MAX_INTERVALS) array.
+    Every rhythm must have MIN_INTERVALS to MAX_INTERVALS gaps; see usable_rhythm().
+    """
+
+    def __init__(self, rhythms):
+        self.lengths = np.array([len(r) for r in rhythms], dtype=int)
+        self.patterns = np.zeros((len(rhythms), MAX_INTERVALS), dtype=np.float32)
+        for k, rhythm in enumerate(rhythms):
+            self.patterns[k, :len(rhythm)] = normalize(rhythm)
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+def attempt_windows(intervals):
+    """
+    Every run of consecutive attempt intervals, normalised on its own:
+    windows[n, s] holds the n intervals starting at s (zero-padded), so an enrolled
+    pattern of n gaps is compared with windows[n]. valid[n, s] is False past the end.
+    """
+    intervals = np.asarray(intervals, dtype=np.float32)[:MAX_WINDOWS]
+    count = len(intervals)
+    lengths = np.arange(MAX_INTERVALS + 1)[:, None]
+    starts = np.arange(max(count, 1))[None, :]
+    valid = (starts + lengths <= count) & (lengths > 0)
+
+    padded = np.concatenate((intervals, np.zeros(MAX_INTERVALS, dtype=np.float32)))
+    offsets = np.arange(MAX_INTERVALS)
+    runs = padded[starts[0][:, None] + offsets[None, :]]  # (starts, MAX_INTERVALS)
+    inside = offsets[None, None, :] < lengths[:, :, None]  # (lengths, 1, MAX_INTERVALS)
+    windows = np.where(inside, runs[None, :, :], 0)
+    means = windows.sum(axis=2, keepdims=True) / np.maximum(lengths, 1)[:, :, None]
+    windows = windows / np.where(means > 0, means, 1)
+    return windows.astype(np.float32), valid
+
+
+def rhythm_distances(intervals, batch):
+    """
+    Distance from the attempt to every enrolled pattern in one vectorised expression:
+    the mean absolute difference between the pattern's normalised gaps and the best
+    matching run of the attempt's gaps, so stray knocks before or after do not matter.
+    """
+    if len(batch) == 0:
+        return np.zeros(0, dtype=np.float32)
+    windows, valid = attempt_windows(intervals)
+    deviation = np.abs(batch.patterns[:, None, :] - windows[batch.lengths]).sum(axis=2)
+    deviation = np.where(valid[batch.lengths], deviation, np.inf)
+    return deviation.min(axis=1) / np.maximum(batch.lengths, 1)
+
+
+def best_match(intervals, batch, usable=None, threshold=RHYTHM_THRESHOLD):
+    """Index of the closest usable pattern and its distance, or (None, distance) if none is close enough"""
+    distances = rhythm_distances(intervals, batch)
+    if usable is not None:
+        distances = np.where(usable, distances, np.inf)
+    if len(distances) == 0:
+        return None, np.inf
+    best = int(np.argmin(distances))
+    if distances[best] > threshold:
+        return None, float(distances[best])
+    return best, float(distances[best])
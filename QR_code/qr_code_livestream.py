@@ -9,6 +9,11 @@ import os
 import secrets
 from datetime import datetime, timedelta
 import qrcode
+from metrics import UNLOCK_STAGE_SECONDS
+import tracing
+from frame_bus import FrameBus
+from frame_watchdog import FRESH_FRAME_TIMEOUT, NoFreshFrame
+from sensing_pool import SensingError, pool
 
 # Configuration
 QR_DATABASE = "qr_codes.json"
@@ -16,6 +21,25 @@ QR_CODE_DIR = "qr_codes"
 PASSWORD_LENGTH = 32
 FASTAPI_STREAM_URL = "http://localhost:8080/video_feed"  # FastAPI stream endpoint
 
+# ID of the QR code accepted by the last verify_qr_code() call, for the access log
+matched_id = None
+
+# Stage latency histograms, looked up once so the scan loop only pays for observe()
+FRAME_WAIT_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="frame_wait")
+IMDECODE_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="imdecode")
+GRAYSCALE_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="grayscale")
+PYZBAR_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="pyzbar_decode")
+VERIFY_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="verify_qr_code")
+
+# How often a scan waiting for frames checks whether it has been cancelled
+CANCEL_CHECK_INTERVAL = 0.1
+
+# Stream reconnection by MJPEGFrameGrabber
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 2.0  # A stream silent for this long is considered stalled
+RECONNECT_BACKOFF = 0.5  # Seconds before the first reconnection, doubling up to the maximum
+MAX_RECONNECT_BACKOFF = 10.0
+
 def initialize_database():
     """Create an empty database if it doesn't exist"""
     if not os.path.exists(QR_DATABASE):
@@ -33,8 +57,12 @@ def load_database():
 
 def save_database(data):
     """Save the QR code database"""
-    with open(QR_DATABASE, 'w') as f:
-        json.dump(data, f, indent=2)
+    # Write to a temporary file and swap it in, so readers never see a half-written database
+    tmp_path = QR_DATABASE + ".tmp"
+    with tracing.span("save_qr_database"):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, QR_DATABASE)
 
 def generate_password():
     """Generate a secure random password"""
@@ -105,6 +133,8 @@ def delete_qr_code(qr_id):
 
 def verify_qr_code(password):
     """Verify if a QR code is valid"""
+    global matched_id
+    matched_id = None
     data = load_database()
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -114,6 +144,7 @@ def verify_qr_code(password):
                 (entry['expiration_time'] is None or
                  entry['expiration_time'] > current_time)):
             print(f"Access granted for QR code ID: {entry['id']}")
+            matched_id = entry['id']
             if entry['is_one_time']:
                 delete_qr_code(entry['id'])
             return True
@@ -121,38 +152,144 @@ def verify_qr_code(password):
     print("Access denied: Invalid or expired QR code")
     return False
 
+def prepare_qr_operations(operations):
+    """
+    Apply a list of add/edit/delete operations in order to the database in memory.
+    Added codes get the next free ID and a new password.
+    Returns (applied, results, save): results holds one {"id", "status", "detail"} dict per
+    operation, and save() generates the QR images of added codes and then writes the
+    database once; only call it if applied.
+    """
+    initialize_database()
+    data = load_database()
+    active = {entry['id']: entry for entry in data if entry['deletion_time'] is None}
+    next_id = max([entry['id'] for entry in data], default=0) + 1
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    results = []
+    added = []
+
+    for operation in operations:
+        op = operation['op']
+        qr_id = operation.get('id')
+        error = None
+
+        if op == "add":
+            qr_id = next_id
+            next_id += 1
+            new_entry = {
+                "id": qr_id,
+                "name": operation.get('name'),
+                "password": generate_password(),
+                "creation_time": current_time,
+                "expiration_time": operation.get('expiration_time'),
+                "deletion_time": None,
+                "is_one_time": operation.get('type') == "one-time",
+                "qr_code_file": f"qr_code_{qr_id}.png"
+            }
+            data.append(new_entry)
+            active[qr_id] = new_entry
+            added.append(new_entry)
+        elif op == "edit":
+            if qr_id not in active:
+                error = f"QR code {qr_id} not found or already deleted"
+            else:
+                # Fields left out of the operation keep their stored value
+                entry = active[qr_id]
+                if 'name' in operation:
+                    entry['name'] = operation['name']
+                if 'expiration_time' in operation:
+                    entry['expiration_time'] = operation['expiration_time']
+                if 'type' in operation:
+                    entry['is_one_time'] = operation['type'] == "one-time"
+        elif op == "delete":
+            if qr_id not in active:
+                error = f"QR code {qr_id} not found or already deleted"
+            else:
+                active.pop(qr_id)['deletion_time'] = current_time
+        else:
+            error = f"unknown operation '{op}'"
+
+        results.append({"id": qr_id, "status": "error" if error else "ok", "detail": error})
+
+    def save():
+        # Images first: if one cannot be generated, the database is left untouched
+        for entry in added:
+            generate_qr_code(entry['password'], entry['id'])
+        save_database(data)
+
+    applied = all(result['status'] == "ok" for result in results)
+    return applied, results, save
+
 class MJPEGFrameGrabber(threading.Thread):
+    """
+    Keeps the newest JPEG of an MJPEG stream. A broken connection, or a read that stalls
+    for READ_TIMEOUT, makes it reconnect, waiting longer after each attempt that brings
+    no frames, so a restarted stream is picked up again instead of freezing the frame.
+    """
+
     def __init__(self, url):
         super().__init__()
         self.url = url
         self.latest_frame = None
+        self.sequence = 0  # Frames received so far
+        self.error = None  # Why the last connection ended, if it failed
         self.running = True
         self.lock = threading.Lock()
         self.daemon = True  # Thread exits with the main program
 
     def run(self):
-        stream = requests.get(self.url, stream=True)
-        bytes_data = bytes()
+        backoff = RECONNECT_BACKOFF
         while self.running:
-            chunk = stream.raw.read(8192)
-            if not chunk:
-                continue
-            bytes_data += chunk
-            a = bytes_data.find(b'\xff\xd8')
-            b = bytes_data.find(b'\xff\xd9')
-            while a != -1 and b != -1 and b > a:
-                jpg = bytes_data[a:b+2]
-                # Update the latest frame thread-safely
-                with self.lock:
-                    self.latest_frame = jpg
-                bytes_data = bytes_data[b+2:]
+            received = self.sequence
+            try:
+                self.read_stream()
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+            if not self.running:
+                break
+            if self.sequence > received:
+                backoff = RECONNECT_BACKOFF
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF)
+
+    def read_stream(self):
+        """Read frames until the stream ends, stalls or the grabber is stopped"""
+        with tracing.span("grabber_connect", url=self.url):
+            stream = requests.get(self.url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        try:
+            stream.raise_for_status()
+            bytes_data = bytes()
+            while self.running:
+                with tracing.span("stream_read"):
+                    chunk = stream.raw.read(8192)
+                if not chunk:
+                    self.error = "stream ended"
+                    return
+                bytes_data += chunk
                 a = bytes_data.find(b'\xff\xd8')
                 b = bytes_data.find(b'\xff\xd9')
+                while a != -1 and b != -1 and b > a:
+                    with tracing.span("frame_split"):
+                        jpg = bytes_data[a:b+2]
+                        # Update the latest frame thread-safely
+                        with self.lock:
+                            self.latest_frame = jpg
+                            self.sequence += 1
+                        bytes_data = bytes_data[b+2:]
+                    a = bytes_data.find(b'\xff\xd8')
+                    b = bytes_data.find(b'\xff\xd9')
+        finally:
+            stream.close()
 
     def get_latest_frame(self):
         with self.lock:
             return self.latest_frame
 
+    def latest(self):
+        """(sequence, JPEG) of the newest frame; the sequence only changes when a new frame arrives"""
+        with self.lock:
+            return self.sequence, self.latest_frame
+
     def stop(self):
         self.running = False
 
@@ -190,38 +327,121 @@ def scan_qr_code():
         grabber.stop()
         cv2.destroyAllWindows()
 
-def one_time_qr_scan(timeout=30):
+def decode_qr_codes(image):
+    """Text of every QR code pyzbar finds in the image; run as a sensing pool job"""
+    return [obj.data.decode('utf-8') for obj in pyzbar.decode(image)]
+
+def decode_on_pool(image):
+    """decode_qr_codes() on a sensing worker; a failed or timed-out decode finds nothing"""
+    try:
+        return pool.submit("decode_qr", image)
+    except SensingError as e:
+        print(f"QR decode failed: {e}")
+        return []
+
+def open_frame_bus():
+    """The camera's shared-memory frame bus, or None when livestream.py is not publishing one"""
+    try:
+        return FrameBus.attach()
+    except FileNotFoundError:
+        return None
+
+def scan_frame_bus(bus, timeout, stop_event=None):
+    """
+    one_time_qr_scan() on the raw frames of the frame bus: each new frame is converted to
+    greyscale straight out of shared memory, with no HTTP, JPEG decode or full-size copy.
+    Raises NoFreshFrame as soon as the newest frame is older than FRESH_FRAME_TIMEOUT
+    """
+    gray = np.empty((bus.height, bus.width), dtype=np.uint8)
+    deadline = time.time() + timeout
+    sequence = 0
+    waiting_since = time.perf_counter()
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0 or (stop_event is not None and stop_event.is_set()):
+            return False
+        age = bus.frame_age()
+        if age is None or age > FRESH_FRAME_TIMEOUT:
+            # Never scan a frozen picture: the code in it may have been shown long ago
+            raise NoFreshFrame("the camera has published no frame yet" if age is None else
+                               f"the newest camera frame is {age:.1f} s old; is livestream.py healthy?")
+        sequence, view = bus.frame_view(sequence, timeout=min(remaining, CANCEL_CHECK_INTERVAL))
+        if view is None:
+            continue
+        FRAME_WAIT_SECONDS.observe(time.perf_counter() - waiting_since)
+
+        with GRAYSCALE_SECONDS.time(), tracing.span("grayscale", sequence=sequence):
+            cv2.cvtColor(view, cv2.COLOR_BGR2GRAY, dst=gray)
+        if not bus.is_current(sequence):
+            # The camera overwrote the slot while we read it; move on to a newer frame
+            waiting_since = time.perf_counter()
+            continue
+
+        with PYZBAR_SECONDS.time(), tracing.span("pyzbar_decode"):
+            decoded = decode_on_pool(gray)
+        if decoded:
+            with VERIFY_SECONDS.time(), tracing.span("verify_qr_code"):
+                return verify_qr_code(decoded[0])
+
+        waiting_since = time.perf_counter()
+
+def one_time_qr_scan(timeout=30, stop_event=None):
     """
     Scan continuously until a QR code is detected, then return verification result
-    Returns True if valid QR, False if invalid QR or timeout reached
-    Uses threaded frame grabbing for low latency
+    Returns True if valid QR, False if invalid QR, timeout reached or stop_event set
+    Reads the camera's frame bus when there is one, else the HTTP stream on a grabber thread
+    Raises NoFreshFrame when no new frame has arrived for FRESH_FRAME_TIMEOUT
     """
+    bus = open_frame_bus()
+    if bus is not None:
+        try:
+            return scan_frame_bus(bus, timeout, stop_event)
+        finally:
+            bus.close()
+
     grabber = MJPEGFrameGrabber(FASTAPI_STREAM_URL)
     grabber.start()
     start_time = time.time()
 
     try:
+        waiting_since = time.perf_counter()
+        sequence = 0
+        last_frame_at = time.monotonic()
         while time.time() - start_time < timeout:
-            jpg = grabber.get_latest_frame()
-            if jpg is None:
+            if stop_event is not None and stop_event.is_set():
+                break
+            latest_sequence, jpg = grabber.latest()
+            if latest_sequence == sequence:
+                # Only new frames are decoded; a frozen stream fails the attempt early
+                if time.monotonic() - last_frame_at > FRESH_FRAME_TIMEOUT:
+                    reason = f" ({grabber.error})" if grabber.error else ""
+                    raise NoFreshFrame(f"no frame from {FASTAPI_STREAM_URL} for "
+                                       f"{FRESH_FRAME_TIMEOUT:.0f} s{reason}")
                 time.sleep(0.01)
                 continue
+            sequence = latest_sequence
+            last_frame_at = time.monotonic()
+            FRAME_WAIT_SECONDS.observe(time.perf_counter() - waiting_since)
 
-            frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            with IMDECODE_SECONDS.time(), tracing.span("imdecode", size=len(jpg)):
+                frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
             if frame is None:
+                waiting_since = time.perf_counter()
                 continue
 
-            decoded_objs = pyzbar.decode(frame)
-            if decoded_objs:
-                qr_data = decoded_objs[0].data.decode('utf-8')
-                result = verify_qr_code(qr_data)
+            with PYZBAR_SECONDS.time(), tracing.span("pyzbar_decode"):
+                decoded = decode_on_pool(frame)
+            if decoded:
+                with VERIFY_SECONDS.time(), tracing.span("verify_qr_code"):
+                    result = verify_qr_code(decoded[0])
                 return result
 
+            waiting_since = time.perf_counter()
+
             time.sleep(0.01)
         return False
     finally:
         grabber.stop()
-        cv2.destroyAllWindows()
 
 def list_qr_codes():
     """List all active QR codes"""
@@ -0,0 +1,315 @@
+import argparse
+import datetime
+import json
+import os
+from math import gcd
+
+import numpy as np
+from scipy.fft import dct, rfft
+from scipy.signal import resample_poly
+
+from metrics import UNLOCK_STAGE_SECONDS
+import tracing
+import audio_capture
+
+# Configuration
+VOICE_DATABASE = "voice_passphrases.json"
+TEMPLATE_DIR = "voice_templates"
+RECORD_SECONDS = 3.0  # Time given to say the passphrase after the button press
+PRE_ROLL = 0.5  # Seconds from before the press, in case speaking starts with it
+FEATURE_RATE = 16000  # Audio is resampled to this before feature extraction
+FRAME_LENGTH = 400  # 25 ms analysis windows...
+FRAME_STEP = 160  # ...every 10 ms
+N_FFT = 512
+N_MELS = 26
+N_MFCC = 13
+PRE_EMPHASIS = 0.97
+SILENCE_DB = 35  # Frames this far below the loudest are trimmed from the ends
+MIN_SPEECH_FRAMES = 20  # Shorter utterances are rejected
+DTW_BAND = 0.2  # Sakoe-Chiba band, as a fraction of the utterance length
+DTW_CHUNK = 64  # Templates per vectorised pass; keeps its arrays near 10 MB for 2 s phrases
+MATCH_THRESHOLD = 12.0  # Highest path-normalised DTW distance accepted as a match
+
+# Id of the user matched by the last start_voice_unlock() call, for the access log
+matched_id = None
+# Templates of the active users, padded into one batch, for the database mtime they were loaded at
+template_cache = (None, None)
+
+RECORD_VOICE_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="record_voice")
+VOICE_FEATURES_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="voice_features")
+VOICE_MATCH_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="voice_match")
+
+''' Feature Extraction '''
+mel_filterbank_cache = {}
+
+
+def mel_filterbank(samplerate=FEATURE_RATE, n_fft=N_FFT, n_mels=N_MELS):
+    """Triangular mel filters as an (n_mels, n_fft // 2 + 1) matrix, built once"""
+    key = (samplerate, n_fft, n_mels)
+    if key not in mel_filterbank_cache:
+        mel_points = np.linspace(0, 2595 * np.log10(1 + samplerate / 2 / 700), n_mels + 2)
+        hz_points = 700 * (10 ** (mel_points / 2595) - 1)
+        bins = np.fft.rfftfreq(n_fft, 1 / samplerate)
+        lower, center, upper = hz_points[:-2, None], hz_points[1:-1, None], hz_points[2:, None]
+        rising = (bins - lower) / (center - lower)
+        falling = (upper - bins) / (upper - center)
+        mel_filterbank_cache[key] = np.maximum(0, np.minimum(rising, falling)).astype(np.float32)
+    return mel_filterbank_cache[key]
+
+
+def mfcc(signal, samplerate=FEATURE_RATE):
+    """
+    MFCCs of a mono signal as a (frames, N_MFCC) array, plus each frame's log energy.
+    Every step works on all frames at once: framing is a strided view, and the FFT,
+    filterbank and DCT are single calls over the frame matrix.
+    """
+    if len(signal) < FRAME_LENGTH:
+        return np.zeros((0, N_MFCC), dtype=np.float32), np.zeros(0, dtype=np.float32)
+    signal = np.append(signal[0], signal[1:] - PRE_EMPHASIS * signal[:-1]).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(signal, FRAME_LENGTH)[::FRAME_STEP]
+    frames = frames * np.hamming(FRAME_LENGTH).astype(np.float32)
+    power = np.abs(rfft(frames, N_FFT)) ** 2 / N_FFT
+    energy = np.log10(power.sum(axis=1) + 1e-10)
+    mel_energies = np.log(power @ mel_filterbank(samplerate).T + 1e-10)
+    return dct(mel_energies, type=2, axis=1, norm='ortho')[:, 1:N_MFCC + 1], energy
+
+
+def extract_features(audio, samplerate):
+    """
+    Passphrase features from raw audio: resampled, MFCCs, leading/trailing silence
+    trimmed and cepstral mean removed, so the microphone and room matter less.
+    Returns None if there is too little speech.
+    """
+    signal = audio[:, 0] if audio.ndim == 2 else audio
+    if samplerate != FEATURE_RATE:
+        divisor = gcd(int(samplerate), FEATURE_RATE)
+        signal = resample_poly(signal, FEATURE_RATE // divisor, int(samplerate) // divisor)
+    features, energy = mfcc(signal)
+    if len(features) == 0:
+        return None
+    speech = np.flatnonzero(energy > energy.max() - SILENCE_DB / 10)
+    features = features[speech[0]:speech[-1] + 1]
+    if len(features) < MIN_SPEECH_FRAMES:
+        return None
+    return (features - features.mean(axis=0)).astype(np.float32)
+
+
+''' Matching '''
+class TemplateBatch:
+    """Enrolled templates zero-padded into one (templates, frames, N_MFCC) array"""
+
+    def __init__(self, templates, owners):
+        self.owners = np.array(owners, dtype=int)
+        self.lengths = np.array([len(t) for t in templates], dtype=int)
+        self.features = np.zeros((len(templates), max(self.lengths, default=0), N_MFCC), dtype=np.float32)
+        for k, template in enumerate(templates):
+            self.features[k, :len(template)] = template
+        self.norms = (self.features ** 2).sum(axis=2)
+
+    def __len__(self):
+        return len(self.owners)
+
+
+def banded_dtw(query, features, norms, lengths, band):
+    """
+    Banded DTW distance from the query to each of a block of padded templates at once.
+    The local cost matrices of all templates come from one matrix product. The
+    recursion then walks the anti-diagonals, updating one diagonal of every template
+    per step; in the flattened cost matrix a diagonal is a plain strided slice, and the
+    two previous diagonals are kept as row-indexed arrays, so no step gathers or scatters.
+    """
+    K, L, _ = features.shape
+    N = len(query)
+    # Euclidean distance between every template frame and every query frame: (K, L, N)
+    cost = np.matmul(features, query.T)
+    cost *= -2
+    cost += norms[:, :, None]
+    cost += (query ** 2).sum(axis=1)
+    np.sqrt(np.maximum(cost, 0, out=cost), out=cost)
+
+    # Outside the band (|i / length - j / N| > band), or past a template's end, no path may go.
+    # The band's first and last query frame are worked out per template row, so the
+    # full-size arrays only see two comparisons.
+    rows = np.arange(L)[None, :]
+    position = rows / lengths[:, None]
+    slack = band + 1 / np.minimum(lengths, N)[:, None]
+    first = np.ceil((position - slack) * N).astype(np.float32)
+    last = np.floor((position + slack) * N).astype(np.float32)
+    first[rows >= lengths[:, None]] = N
+    j = np.arange(N, dtype=np.float32)
+    cost[(j < first[:, :, None]) | (j > last[:, :, None])] = np.inf
+    cost = cost.reshape(K, L * N)
+
+    # Accumulated cost of diagonals s-2, s-1 and s, indexed by row i (1-based, row 0 is the border)
+    before, previous, current = (np.full((K, L + 2), np.inf, dtype=np.float32) for _ in range(3))
+    before[:, 0] = 0  # D[0, 0]
+    distances = np.empty(K, dtype=np.float32)
+    ends = lengths + N  # Diagonal on which each template's path ends
+    for s in range(2, L + N + 1):
+        lo, hi = max(1, s - N), min(L, s - 1)
+        first = (lo - 1) * N + (s - lo - 1)  # Flat index of cost[lo - 1, s - lo - 1]
+        diagonal = cost[:, first:first + (hi - lo) * (N - 1) + 1:N - 1]
+        best = np.minimum(np.minimum(before[:, lo - 1:hi], previous[:, lo - 1:hi]), previous[:, lo:hi + 1])
+        current[:, lo - 1] = np.inf
+        current[:, hi + 1] = np.inf
+        np.add(diagonal, best, out=current[:, lo:hi + 1])
+        finished = np.flatnonzero(ends == s)
+        distances[finished] = current[finished, lengths[finished]]
+        before, previous, current = previous, current, before
+    return distances
+
+
+def batched_dtw(query, batch, band=DTW_BAND, chunk=DTW_CHUNK):
+    """
+    DTW distance from the query to every template in the batch, DTW_CHUNK templates per
+    vectorised pass. Distances are divided by the path length bound (template + query
+    frames) so templates of different lengths compare fairly.
+    """
+    distances = np.empty(len(batch), dtype=np.float32)
+    for start in range(0, len(batch), chunk):
+        block = slice(start, start + chunk)
+        lengths = batch.lengths[block]
+        # Trim the padding to the longest template of this block
+        features = batch.features[block, :lengths.max()]
+        norms = batch.norms[block, :lengths.max()]
+        distances[block] = banded_dtw(query, features, norms, lengths, band)
+    return distances / (batch.lengths + len(query))
+
+
+def identify(features, batch, threshold=MATCH_THRESHOLD):
+    """Return (user id, distance) of the closest template, with None as id if it is too far"""
+    if features is None or len(batch) == 0:
+        return None, np.inf
+    distances = batched_dtw(features, batch)
+    best = int(np.argmin(distances))
+    if distances[best] > threshold:
+        return None, float(distances[best])
+    return int(batch.owners[best]), float(distances[best])
+
+
+''' Enrollment Store '''
+def load_database():
+    """Load the voice passphrase database"""
+    if not os.path.exists(VOICE_DATABASE):
+        return []
+    with open(VOICE_DATABASE, 'r') as f:
+        return json.load(f)
+
+
+def save_database(data):
+    """Save the voice passphrase database"""
+    # Write to a temporary file and swap it in, so readers never see a half-written database
+    tmp_path = VOICE_DATABASE + ".tmp"
+    with tracing.span("save_voice_database"):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, VOICE_DATABASE)
+
+
+def load_templates():
+    """The active users' templates as a TemplateBatch, reloaded only when the database changes"""
+    global template_cache
+    mtime = os.path.getmtime(VOICE_DATABASE) if os.path.exists(VOICE_DATABASE) else None
+    if template_cache[0] != mtime or template_cache[1] is None:
+        templates, owners = [], []
+        for entry in load_database():
+            if entry["deletion_time"] is None:
+                for path in entry["templates"]:
+                    templates.append(np.load(path))
+                    owners.append(entry["id"])
+        template_cache = (mtime, TemplateBatch(templates, owners))
+    return template_cache[1]
+
+
+def enroll_user(name, recordings, samplerate):
+    """Add a user with one template per recording of their passphrase; returns the new id"""
+    templates = [extract_features(audio, samplerate) for audio in recordings]
+    if any(template is None for template in templates):
+        raise ValueError("A recording had too little speech; please try again")
+
+    data = load_database()
+    new_id = max([entry['id'] for entry in data], default=0) + 1
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    paths = []
+    for n, template in enumerate(templates):
+        path = os.path.join(TEMPLATE_DIR, f"voice_{new_id}_{n}.npy")
+        np.save(path, template)
+        paths.append(path)
+
+    data.append({
+        "id": new_id,
+        "name": name,
+        "creation_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "deletion_time": None,
+        "templates": paths,
+    })
+    save_database(data)
+    return new_id
+
+
+def delete_user(user_id):
+    """Mark a user as deleted (soft delete)"""
+    data = load_database()
+    for entry in data:
+        if entry['id'] == user_id and entry['deletion_time'] is None:
+            entry['deletion_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            save_database(data)
+            return True
+    return False
+
+
+''' Unlocking '''
+def start_voice_unlock(stop_event=None):
+    """
+    Record the passphrase from the always-open microphone and match it against every
+    enrolled user. Setting stop_event ends the recording early and the attempt fails.
+    """
+    global matched_id
+    matched_id = None
+    capture = audio_capture.capture
+
+    with RECORD_VOICE_SECONDS.time(), tracing.span("record_voice"):
+        capture.start()
+        print(f"Say the passphrase ({RECORD_SECONDS:.0f} seconds)...")
+        audio = capture.record(RECORD_SECONDS, pre_roll=PRE_ROLL, stop_event=stop_event)
+    if stop_event is not None and stop_event.is_set():
+        return False
+
+    with VOICE_FEATURES_SECONDS.time(), tracing.span("voice_features"):
+        features = extract_features(audio, capture.samplerate)
+    with VOICE_MATCH_SECONDS.time(), tracing.span("voice_match"):
+        user_id, distance = identify(features, load_templates())
+
+    print(f"Voice match: user {user_id}, distance {distance:.2f}")
+    matched_id = user_id
+    return user_id is not None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Voice passphrase enrollment.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    enroll = commands.add_parser('enroll', help='Record a new user saying their passphrase')
+    enroll.add_argument('name')
+    enroll.add_argument('-n', '--samples', type=int, default=3, help='Recordings to take')
+    commands.add_parser('list', help='List enrolled users')
+    delete = commands.add_parser('delete', help='Delete a user')
+    delete.add_argument('id', type=int)
+    commands.add_parser('test', help='Record once and show the closest user')
+    args = parser.parse_args()
+
+    if args.command == 'enroll':
+        audio_capture.capture.start()
+        recordings = []
+        for n in range(args.samples):
+            input(f"Press Enter, then say the passphrase ({n + 1}/{args.samples})")
+            recordings.append(audio_capture.capture.record(RECORD_SECONDS, pre_roll=0))
+        print(f"Enrolled user {enroll_user(args.name, recordings, audio_capture.capture.samplerate)}")
+    elif args.command == 'list':
+        for entry in load_database():
+            if entry['deletion_time'] is None:
+                print(f"{entry['id']}: {entry['name']} ({len(entry['templates'])} templates, "
+                      f"enrolled {entry['creation_time']})")
+    elif args.command == 'delete':
+        print("Deleted" if delete_user(args.id) else f"User {args.id} not found or already deleted")
+    elif args.command == 'test':
+        print("Access granted" if start_voice_unlock() else "Access denied")
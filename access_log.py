@@ -0,0 +1,192 @@
+import bisect
+import os
+import struct
+import threading
+import time
+
+# Configuration
+ACCESS_LOG_DIR = "access_log"
+SEGMENT_MAX_BYTES = 1024 * 1024  # Start a new segment after 1 MB...
+SEGMENT_MAX_AGE = 24 * 60 * 60  # ...or after a day, whichever comes first (seconds)
+MAX_SEGMENTS = 180  # Oldest segments are deleted beyond this
+INDEX_INTERVAL = 256  # One sparse index entry every this many records
+
+# Record: timestamp (ms), method, credential id (-1 if unknown), outcome, latency (ms)
+RECORD = struct.Struct("<QBiBf")
+INDEX_ENTRY = struct.Struct("<QQ")  # timestamp (ms), byte offset in the segment
+READ_CHUNK = RECORD.size * 4096  # Whole records only
+
+METHODS = ["unknown", "qr", "morse", "voice"]
+OUTCOMES = ["denied", "unlocked", "error"]
+
+
+class AccessLog:
+    """
+    Append-only log of unlock attempts split into time-ordered segment files.
+    Each segment "<first timestamp>.seg" has a sparse "<first timestamp>.idx" file that
+    maps every INDEX_INTERVAL-th record's timestamp to its offset, so range queries
+    only read the part of a segment they need.
+    """
+
+    def __init__(self, directory=ACCESS_LOG_DIR, max_bytes=SEGMENT_MAX_BYTES,
+                 max_age=SEGMENT_MAX_AGE, max_segments=MAX_SEGMENTS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_ms = int(max_age * 1000)
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.index_cache = {}  # Segment start -> (timestamps, offsets) of its sparse index
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg"))
+        self.segment_file = None
+        self.index_file = None
+        if self.segments:
+            self.open_segment(self.segments[-1])
+
+    def path(self, segment, extension):
+        return os.path.join(self.directory, f"{segment}.{extension}")
+
+    def open_segment(self, segment):
+        """Open a segment for appending, dropping a torn trailing record and rebuilding its index"""
+        seg_path = self.path(segment, "seg")
+        self.segment_file = open(seg_path, "ab")
+        size = os.path.getsize(seg_path)
+        if size % RECORD.size:
+            size -= size % RECORD.size
+            self.segment_file.truncate(size)
+
+        timestamps, offsets = [], []
+        with open(seg_path, "rb") as f:
+            for number in range(0, size // RECORD.size, INDEX_INTERVAL):
+                f.seek(number * RECORD.size)
+                timestamps.append(RECORD.unpack(f.read(RECORD.size))[0])
+                offsets.append(number * RECORD.size)
+        with open(self.path(segment, "idx"), "wb") as f:
+            for entry in zip(timestamps, offsets):
+                f.write(INDEX_ENTRY.pack(*entry))
+        self.index_file = open(self.path(segment, "idx"), "ab")
+
+        self.segment_start = segment
+        self.segment_size = size
+        self.index_cache[segment] = (timestamps, offsets)
+
+    def rotate(self, timestamp):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.index_file.close()
+        self.segments.append(timestamp)
+        self.open_segment(timestamp)
+
+        while len(self.segments) > self.max_segments:
+            oldest = self.segments.pop(0)
+            self.index_cache.pop(oldest, None)
+            for extension in ("seg", "idx"):
+                try:
+                    os.remove(self.path(oldest, extension))
+                except FileNotFoundError:
+                    pass
+
+    def append(self, method, outcome, credential_id=None, latency=0.0, timestamp=None):
+        """Append one record; method and outcome are names from METHODS and OUTCOMES"""
+        timestamp = int((time.time() if timestamp is None else timestamp) * 1000)
+        record = RECORD.pack(timestamp, METHODS.index(method) if method in METHODS else 0,
+                             -1 if credential_id is None else credential_id,
+                             OUTCOMES.index(outcome), latency * 1000)
+
+        with self.lock:
+            if (self.segment_file is None or self.segment_size >= self.max_bytes or
+                    timestamp - self.segment_start >= self.max_age_ms):
+                self.rotate(timestamp)
+
+            if (self.segment_size // RECORD.size) % INDEX_INTERVAL == 0:
+                self.index_file.write(INDEX_ENTRY.pack(timestamp, self.segment_size))
+                self.index_file.flush()
+                timestamps, offsets = self.index_cache[self.segment_start]
+                timestamps.append(timestamp)
+                offsets.append(self.segment_size)
+
+            self.segment_file.write(record)
+            # Hand the record to the OS without forcing a sync, so the SD card sees batched writes
+            self.segment_file.flush()
+            self.segment_size += RECORD.size
+
+    def load_index(self, segment):
+        if segment not in self.index_cache:
+            timestamps, offsets = [], []
+            with open(self.path(segment, "idx"), "rb") as f:
+                for timestamp, offset in INDEX_ENTRY.iter_unpack(f.read()):
+                    timestamps.append(timestamp)
+                    offsets.append(offset)
+            self.index_cache[segment] = (timestamps, offsets)
+        return self.index_cache[segment]
+
+    @staticmethod
+    def parse_cursor(cursor, segments):
+        """(segment, offset) of a "segment:offset" cursor; ValueError if malformed or its segment is gone"""
+        parts = cursor.split(":")
+        if len(parts) != 2 or not all(part.isdigit() for part in parts):
+            raise ValueError("cursor must be a next_cursor returned by an earlier page")
+        segment, offset = int(parts[0]), int(parts[1])
+        if offset % RECORD.size:
+            raise ValueError("cursor must be a next_cursor returned by an earlier page")
+        if segment not in segments:
+            raise ValueError("cursor points into a segment that has been deleted")
+        return segment, offset
+
+    def query(self, start=None, end=None, limit=100, cursor=None):
+        """
+        Return up to limit records with start <= timestamp <= end (seconds since the epoch),
+        oldest first, plus a cursor string to pass back for the next page (None at the end).
+        Raises ValueError for a cursor that is malformed or points into a deleted segment.
+        """
+        start_ms = 0 if start is None else int(start * 1000)
+        end_ms = 2 ** 64 - 1 if end is None else int(end * 1000)
+
+        with self.lock:
+            segments = list(self.segments)
+            active_segment = segments[-1] if segments else None
+            active_size = self.segment_size if segments else 0
+        cursor_segment, cursor_offset = self.parse_cursor(cursor, segments) if cursor else (None, 0)
+
+        records = []
+        for i, segment in enumerate(segments):
+            next_segment = segments[i + 1] if i + 1 < len(segments) else None
+            if segment > end_ms or (next_segment is not None and next_segment <= start_ms):
+                continue
+            if cursor_segment is not None and segment < cursor_segment:
+                continue
+
+            size = active_size if segment == active_segment else os.path.getsize(self.path(segment, "seg"))
+            timestamps, offsets = self.load_index(segment)
+            # Start from the last indexed record at or before the range start
+            position = bisect.bisect_right(timestamps, start_ms) - 1
+            offset = offsets[position] if position >= 0 else 0
+            if segment == cursor_segment:
+                offset = max(offset, cursor_offset)
+
+            with open(self.path(segment, "seg"), "rb") as f:
+                f.seek(offset)
+                while offset < size:
+                    chunk = f.read(min(READ_CHUNK, size - offset))
+                    if not chunk:
+                        break
+                    for timestamp, method, credential_id, outcome, latency in RECORD.iter_unpack(chunk):
+                        if timestamp > end_ms:
+                            return records, None
+                        if timestamp >= start_ms:
+                            if len(records) == limit:
+                                return records, f"{segment}:{offset}"
+                            records.append({
+                                "timestamp": timestamp / 1000,
+                                "method": METHODS[method],
+                                "credential_id": None if credential_id == -1 else credential_id,
+                                "outcome": OUTCOMES[outcome],
+                                "latency": round(latency / 1000, 4),
+                            })
+                        offset += RECORD.size
+
+        return records, None
+
+
+access_log = AccessLog()
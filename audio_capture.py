@@ -0,0 +1,97 @@
+import threading
+import time
+
+import numpy as np
+
+# Configuration
+SAMPLE_RATE = 44100
+CHANNELS = 1
+PRE_ROLL = 3.0  # Seconds of audio from before a request that recordings include
+MAX_RECORDING = 12.0  # Longest live part of a recording, in seconds
+BLOCK_MARGIN = 1.0  # Room for the block being written while a recording is copied out
+
+
+class AudioCapture:
+    """
+    Keeps the microphone open and the most recent audio in a preallocated ring, so a
+    recording can start PRE_ROLL seconds in the past and pays no device-open latency.
+    The stream callback only copies each block into the ring and advances a frame
+    counter; recordings copy their span out of the ring once it has been captured.
+    """
+
+    def __init__(self, samplerate=SAMPLE_RATE, channels=CHANNELS, device=None,
+                 pre_roll=PRE_ROLL, max_recording=MAX_RECORDING):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.device = device
+        self.pre_roll = pre_roll
+        self.max_recording = max_recording
+        self.capacity = int((pre_roll + max_recording + BLOCK_MARGIN) * samplerate)
+        self.ring = np.zeros((self.capacity, channels), dtype=np.float32)
+        self.frames = 0  # Frames captured since start(); frame n is at ring[n % capacity]
+        self.stream = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.stream is not None
+
+    def start(self):
+        """Open the microphone; does nothing if it is already open"""
+        import sounddevice as sd
+
+        with self.lock:
+            if self.stream is not None:
+                return
+            self.stream = sd.InputStream(device=self.device, channels=self.channels,
+                                         samplerate=self.samplerate, dtype='float32',
+                                         callback=self.callback)
+            self.stream.start()
+
+    def stop(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+    def callback(self, indata, frames, time_info, status):
+        """Runs on the audio thread for every block, so it must stay this small"""
+        start = self.frames % self.capacity
+        first = min(frames, self.capacity - start)
+        self.ring[start:start + first] = indata[:first]
+        self.ring[:frames - first] = indata[first:frames]
+        self.frames += frames
+
+    def copy(self, start, end):
+        """Frames start..end (counted since start()) as a new array"""
+        start = max(start, end - self.capacity + int(BLOCK_MARGIN * self.samplerate), 0)
+        first, last = start % self.capacity, end % self.capacity
+        if end - start == 0:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        if first < last:
+            return self.ring[first:last].copy()
+        return np.concatenate((self.ring[first:], self.ring[:last]))
+
+    def record(self, duration, pre_roll=None, stop_event=None):
+        """
+        Return the last pre_roll seconds plus the next duration seconds of audio, waiting
+        for the live part; setting stop_event returns early with what has been captured
+        """
+        pre_roll = self.pre_roll if pre_roll is None else min(pre_roll, self.pre_roll)
+        duration = min(duration, self.max_recording)
+        now = self.frames
+        start = now - int(pre_roll * self.samplerate)
+        end = now + int(duration * self.samplerate)
+
+        deadline = time.monotonic() + duration + 1.0  # In case the stream stalls
+        while self.frames < end and time.monotonic() < deadline:
+            remaining = (end - self.frames) / self.samplerate
+            if stop_event is None:
+                time.sleep(remaining)
+            elif stop_event.wait(remaining):
+                break
+        return self.copy(start, min(self.frames, end))
+
+
+# The one capture of this process, started by whoever needs it first
+capture = AudioCapture()
@@ -0,0 +1,452 @@
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+
+# Configuration
+RESOLUTION = (640, 480)
+FRAMERATE = 30
+FRAME_SLOTS = 4  # Frames kept in the ring; readers copy a frame out before it is reused
+MAX_FRAME_BYTES = 512 * 1024  # Larger frames are dropped
+DEFAULT_QUALITY = 85  # JPEG quality of transcoded variants when only the width is given
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+# Multipart framing around each JPEG in the /video_feed response
+FRAME_PREFIX = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+FRAME_SUFFIX = b'\r\n'
+
+
+class FrameOutput:
+    """
+    File-like output for the camera's MJPEG encoder.
+    write() copies each chunk straight into one of FRAME_SLOTS preallocated buffers and
+    publishes the buffer when the JPEG end marker arrives, so no per-frame objects are
+    created on the capture side. Readers get the frame copied once, already framed for
+    the HTTP response.
+    """
+
+    def __init__(self, slots=FRAME_SLOTS, max_frame_bytes=MAX_FRAME_BYTES):
+        self.buffers = [memoryview(bytearray(max_frame_bytes)) for _ in range(slots)]
+        self.slot_sequence = [0] * slots  # Sequence number of the frame held in each slot
+        self.slot_length = [0] * slots
+        self.max_frame_bytes = max_frame_bytes
+        self.slot = 0
+        self.length = 0
+        self.skipping = False  # Set after an oversized frame until the next one starts
+        self.sequence = 0
+        self.latest_slot = None
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.listeners = []  # Called with the sequence number of every published frame
+
+    def write(self, buf):
+        size = len(buf)
+        if buf[:2] == JPEG_START:
+            # A new frame starts; anything left from the previous one was incomplete
+            self.length = 0
+            self.skipping = False
+        if self.skipping:
+            return size
+        if self.length + size > self.max_frame_bytes:
+            self.dropped += 1
+            self.length = 0
+            self.skipping = True
+            return size
+
+        if self.length == 0:
+            # The slot's old frame is about to be overwritten; readers copying it must retry
+            self.slot_sequence[self.slot] = 0
+        self.buffers[self.slot][self.length:self.length + size] = buf
+        self.length += size
+        if buf[-2:] == JPEG_END:
+            self.publish()
+        return size
+
+    def publish(self):
+        with self.condition:
+            self.sequence += 1
+            self.slot_sequence[self.slot] = self.sequence
+            self.slot_length[self.slot] = self.length
+            self.latest_slot = self.slot
+            self.condition.notify_all()
+        self.slot = (self.slot + 1) % len(self.buffers)
+        self.length = 0
+        for listener in self.listeners:
+            listener(self.sequence)
+
+    def flush(self):
+        pass
+
+    def reset(self):
+        """Drop a partly written frame, e.g. before a restarted camera starts writing"""
+        self.length = 0
+        self.skipping = False
+
+    def read_frame(self, last_sequence=0, prefix=b'', suffix=b'', timeout=None):
+        """
+        Wait for a frame newer than last_sequence and return (sequence, prefix + frame + suffix).
+        Returns (last_sequence, None) on timeout.
+        """
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.sequence > last_sequence, timeout):
+                    return last_sequence, None
+                slot = self.latest_slot
+                sequence = self.slot_sequence[slot]
+                length = self.slot_length[slot]
+
+            frame = b''.join((prefix, self.buffers[slot][:length], suffix))
+            # The writer may have lapped the ring while we copied; try again with a newer frame
+            if self.slot_sequence[slot] == sequence:
+                return sequence, frame
+
+
+class RawFrameOutput:
+    """
+    File-like output for the camera's raw BGR recording.
+    write() fills a ring of preallocated height x width x 3 NumPy frames in place.
+    Readers copy the newest frame into a buffer of their own, so they can keep using it
+    while the ring moves on, and no frame is ever allocated after start-up.
+    """
+
+    def __init__(self, resolution=RESOLUTION, slots=FRAME_SLOTS, frames=None):
+        width, height = resolution
+        self.width = width
+        self.height = height
+        if frames is None:
+            frames = [np.zeros(padded_shape(resolution), dtype=np.uint8) for _ in range(slots)]
+        self.frames = frames
+        self.buffers = [memoryview(frame).cast('B') for frame in self.frames]
+        self.frame_bytes = self.frames[0].nbytes
+        self.slot_sequence = [0] * slots
+        self.slot = 0
+        self.length = 0
+        self.sequence = 0
+        self.latest_slot = None
+        self.condition = threading.Condition()
+        self.listeners = []
+
+    def write(self, buf):
+        buf = memoryview(buf).cast('B')
+        offset = 0
+        while offset < len(buf):
+            if self.length == 0:
+                self.begin_frame()
+            size = min(len(buf) - offset, self.frame_bytes - self.length)
+            self.buffers[self.slot][self.length:self.length + size] = buf[offset:offset + size]
+            self.length += size
+            offset += size
+            if self.length == self.frame_bytes:
+                self.publish()
+        return len(buf)
+
+    def begin_frame(self):
+        """Called before the current slot starts being overwritten; readers copying it must retry"""
+        self.slot_sequence[self.slot] = 0
+
+    def publish(self):
+        with self.condition:
+            self.sequence += 1
+            self.slot_sequence[self.slot] = self.sequence
+            self.latest_slot = self.slot
+            self.condition.notify_all()
+        self.slot = (self.slot + 1) % len(self.frames)
+        self.length = 0
+        for listener in self.listeners:
+            listener(self.sequence)
+
+    def flush(self):
+        pass
+
+    def reset(self):
+        """Drop a partly written frame, e.g. before a restarted camera starts writing"""
+        self.length = 0
+
+    def new_frame_buffer(self):
+        """Allocate a buffer for read_frame_into(), once per reader"""
+        return np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def read_frame_into(self, out, last_sequence=0, timeout=None):
+        """
+        Wait for a frame newer than last_sequence and copy it into out.
+        Returns the frame's sequence number, or last_sequence on timeout.
+        """
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.sequence > last_sequence, timeout):
+                    return last_sequence
+                slot = self.latest_slot
+                sequence = self.slot_sequence[slot]
+
+            np.copyto(out, self.frames[slot][:self.height, :self.width])
+            # The writer may have lapped the ring while we copied; try again with a newer frame
+            if self.slot_sequence[slot] == sequence:
+                return sequence
+
+
+class FrameVariant:
+    """A resized/re-encoded version of the stream shared by every client that asks for it"""
+
+    def __init__(self, width, quality):
+        self.width = width
+        self.quality = quality
+        self.clients = 0
+        self.cached = (0, None)  # Latest (source sequence, framed bytes)
+        self.pending = None  # (source sequence, future) of the transcode in progress
+
+
+def transcode(jpg, width, quality, prefix=FRAME_PREFIX, suffix=FRAME_SUFFIX):
+    """Decode a JPEG, scale it down to width (keeping the aspect ratio) and re-encode it"""
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if width is not None and width < image.shape[1]:
+        height = round(image.shape[0] * width / image.shape[1])
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality or DEFAULT_QUALITY])
+    return b''.join((prefix, buffer, suffix))
+
+
+class FrameBroadcaster:
+    """
+    Serves the frames of a FrameOutput to any number of asyncio clients.
+    The capture thread only schedules one wake-up per frame on the event loop, and each
+    frame is copied once no matter how many clients read it. A client that falls behind
+    skips straight to the newest frame instead of queueing old ones.
+    Clients may ask for a smaller width, lower JPEG quality or lower frame rate; each
+    (width, quality) variant is transcoded once per source frame on a worker thread and
+    shared, and is dropped when its last client leaves.
+    """
+
+    def __init__(self, output, prefix=FRAME_PREFIX, suffix=FRAME_SUFFIX):
+        self.output = output
+        self.prefix = prefix
+        self.suffix = suffix
+        self.loop = None
+        self.new_frame = None
+        self.clients = 0
+        self.cached = (0, None)  # Latest (sequence, framed bytes) handed out
+        self.variants = {}  # (width, quality) -> FrameVariant
+        output.listeners.append(self.frame_published)
+
+    def frame_published(self, sequence):
+        # Runs on the capture thread, so it must not block
+        if self.clients:
+            self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        self.new_frame.set()
+        self.new_frame = asyncio.Event()
+
+    def latest(self, last_sequence):
+        if self.output.sequence > self.cached[0]:
+            self.cached = self.output.read_frame(self.cached[0], self.prefix, self.suffix, timeout=0)
+        if self.cached[0] > last_sequence:
+            return self.cached
+        return last_sequence, None
+
+    async def variant_frame(self, variant, sequence, frame):
+        """Return the variant of a source frame, transcoding it only if no other client has"""
+        if variant.cached[0] == sequence:
+            return variant.cached[1]
+        if variant.pending is None or variant.pending[0] != sequence:
+            jpg = memoryview(frame)[len(self.prefix):len(frame) - len(self.suffix)]
+            future = self.loop.run_in_executor(None, transcode, jpg, variant.width, variant.quality,
+                                               self.prefix, self.suffix)
+            variant.pending = (sequence, future)
+        # Shielded so a client disconnecting mid-transcode does not cancel it for the others
+        try:
+            data = await asyncio.shield(variant.pending[1])
+        except Exception as e:
+            print(f"Could not transcode frame {sequence}: {e}")
+            return None
+        if variant.cached[0] < sequence:
+            variant.cached = (sequence, data)
+        return data
+
+    async def frames(self, width=None, quality=None, max_fps=None):
+        """Async generator yielding each new frame for one client"""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.new_frame = asyncio.Event()
+
+        variant = None
+        if width is not None or quality is not None:
+            variant = self.variants.get((width, quality))
+            if variant is None:
+                variant = self.variants[(width, quality)] = FrameVariant(width, quality)
+            variant.clients += 1
+        interval = 1 / max_fps if max_fps else 0
+
+        self.clients += 1
+        sequence = 0
+        next_time = 0
+        try:
+            while True:
+                if interval:
+                    delay = next_time - self.loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                sequence, frame = self.latest(sequence)
+                if frame is None:
+                    await self.new_frame.wait()
+                    continue
+                if variant is not None:
+                    frame = await self.variant_frame(variant, sequence, frame)
+                    if frame is None:
+                        continue
+                next_time = self.loop.time() + interval
+                yield frame
+        finally:
+            self.clients -= 1
+            if variant is not None:
+                variant.clients -= 1
+                if variant.clients == 0:
+                    del self.variants[(width, quality)]
+
+
+class PiCameraSource:
+    """Runs the Pi camera continuously in MJPEG recording mode"""
+
+    def __init__(self, resolution=RESOLUTION, framerate=FRAMERATE):
+        from picamera import PiCamera
+        self.camera = PiCamera()
+        self.camera.resolution = resolution
+        self.camera.framerate = framerate
+        self.ports = []
+        time.sleep(2)  # Allow camera to warm up
+
+    def start(self, output, format='mjpeg', splitter_port=1):
+        """
+        Record continuously as 'mjpeg' or as raw 'bgr' frames. A second recording on
+        another splitter port runs alongside the first, e.g. MJPEG for the stream and
+        raw frames for a FrameBus, from the one camera.
+        """
+        self.camera.start_recording(output, format=format, splitter_port=splitter_port)
+        self.ports.append(splitter_port)
+
+    def stop(self):
+        # The camera is closed even if a hung recording fails to stop, or no new
+        # PiCamera() can be opened to replace it
+        try:
+            for port in self.ports:
+                self.camera.stop_recording(splitter_port=port)
+        finally:
+            self.camera.close()
+
+
+class ReplaySource:
+    """
+    Feeds a fixed list of JPEG frames to the output from a thread, looping forever.
+    framerate=0 writes as fast as possible, which is useful for benchmarking.
+    With format='bgr' the frames are decoded once up front and replayed as raw frames.
+    Like the camera, it can feed several outputs at once, one start() call each.
+    """
+
+    def __init__(self, frames, framerate=FRAMERATE, resolution=RESOLUTION):
+        self.jpeg_frames = frames
+        self.framerate = framerate
+        self.resolution = resolution
+        self.running = False
+        self.threads = []
+
+    def start(self, output, format='mjpeg', splitter_port=1):
+        frames = self.jpeg_frames
+        if format == 'bgr':
+            frames = [raw_frame(frame, self.resolution) for frame in self.jpeg_frames]
+        self.running = True
+        thread = threading.Thread(target=self.run, args=(output, frames), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def run(self, output, frames):
+        interval = 1 / self.framerate if self.framerate else 0
+        next_time = time.perf_counter()
+        while self.running:
+            for frame in frames:
+                if not self.running:
+                    break
+                output.write(frame)
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+
+
+def load_jpeg_frames(path):
+    """Load frames from a directory of .jpg files or from a concatenated MJPEG file"""
+    if os.path.isdir(path):
+        frames = []
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(path, name), 'rb') as f:
+                    frames.append(f.read())
+        return frames
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = []
+    start = data.find(JPEG_START)
+    while start != -1:
+        end = data.find(JPEG_END, start)
+        if end == -1:
+            break
+        frames.append(data[start:end + 2])
+        start = data.find(JPEG_START, end + 2)
+    return frames
+
+
+def padded_shape(resolution):
+    """Shape of a raw BGR frame; the camera pads the width to a multiple of 32 and the height to 16"""
+    width, height = resolution
+    return ((height + 15) // 16 * 16, (width + 31) // 32 * 32, 3)
+
+
+def raw_frame(jpg, resolution=RESOLUTION):
+    """
+    Decode a JPEG into raw BGR bytes laid out like the camera's (padded) output,
+    or noise if it does not decode
+    """
+    import cv2
+
+    width, height = resolution
+    frame = np.zeros(padded_shape(resolution), dtype=np.uint8)
+    image = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        frame[:height, :width] = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    else:
+        frame[:height, :width] = cv2.resize(image, (width, height))
+    return frame.tobytes()
+
+
+def synthetic_frames(count=30, frame_bytes=40 * 1024):
+    """JPEG-shaped frames (start marker, random payload, end marker) for throughput tests"""
+    frames = []
+    for _ in range(count):
+        payload = bytearray(os.urandom(frame_bytes - 4))
+        # Keep the payload free of end markers so each frame splits where expected
+        payload = payload.replace(JPEG_END, b'\xff\x00')
+        frames.append(JPEG_START + bytes(payload) + JPEG_END)
+    return frames
+
+
+def create_camera_source(spec=None, framerate=FRAMERATE, resolution=RESOLUTION):
+    """
+    Build a camera source from a spec string, by default the CAMERA_SOURCE environment variable:
+    "picamera" (default), "synthetic", or "file:<directory of JPEGs or MJPEG file>".
+    """
+    spec = spec or os.environ.get("CAMERA_SOURCE", "picamera")
+    if spec == "picamera":
+        return PiCameraSource(resolution, framerate)
+    if spec == "synthetic":
+        return ReplaySource(synthetic_frames(), framerate, resolution)
+    if spec.startswith("file:"):
+        return ReplaySource(load_jpeg_frames(spec[len("file:"):]), framerate, resolution)
+    raise ValueError(f"Unknown camera source '{spec}'")
@@ -0,0 +1,95 @@
+import collections
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+# Configuration
+CLIP_DIR = "clips"
+BUFFER_BYTES = 8 * 1024 * 1024  # Memory for the pre-roll ring, however many frames that is
+PRE_ROLL = 5  # Seconds of footage kept from before an event
+POST_ROLL = 5  # Seconds of footage recorded after an event
+MAX_CLIP_BYTES = 16 * 1024 * 1024  # Post-roll stops early beyond this
+PENDING_CLIPS = 2  # Finished clips waiting for the writer; more are dropped
+REASON_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")  # Reasons go into the clip's file name
+
+
+class ClipRecorder:
+    """
+    Keeps the most recent JPEG frames of a FrameOutput in a ring capped in bytes, and on
+    trigger() saves PRE_ROLL seconds before and POST_ROLL seconds after the event as one
+    concatenated-JPEG (.mjpeg) file.
+    Frames are collected on a thread of its own and clips are written by another, each with
+    a single sequential write, so neither the camera nor the caller ever waits on the disk.
+    """
+
+    def __init__(self, output, directory=CLIP_DIR, buffer_bytes=BUFFER_BYTES,
+                 pre_roll=PRE_ROLL, post_roll=POST_ROLL, max_clip_bytes=MAX_CLIP_BYTES):
+        self.output = output
+        self.directory = directory
+        self.buffer_bytes = buffer_bytes
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.max_clip_bytes = max_clip_bytes
+        self.ring = collections.deque()  # (timestamp, jpeg bytes)
+        self.ring_bytes = 0
+        self.lock = threading.Lock()
+        self.clip = None  # Clip collecting post-roll: {"name", "frames", "bytes", "until"}
+        self.pending = queue.Queue(maxsize=PENDING_CLIPS)
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        threading.Thread(target=self.collect_frames, daemon=True).start()
+        threading.Thread(target=self.write_clips, daemon=True).start()
+
+    def trigger(self, reason):
+        """Save footage around now; a trigger during another clip's post-roll extends it"""
+        if not REASON_PATTERN.fullmatch(reason):
+            raise ValueError(f"clip reason must match {REASON_PATTERN.pattern}")
+        now = time.time()
+        with self.lock:
+            if self.clip is not None:
+                self.clip["until"] = now + self.post_roll
+                return
+            # Frames are immutable bytes, so the pre-roll is shared with the ring, not copied
+            frames = [jpg for timestamp, jpg in self.ring if timestamp >= now - self.pre_roll]
+            name = f"{datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S')}_{reason}.mjpeg"
+            self.clip = {"name": name, "frames": frames, "bytes": sum(map(len, frames)),
+                         "until": now + self.post_roll}
+
+    def collect_frames(self):
+        sequence = 0
+        while True:
+            sequence, jpg = self.output.read_frame(sequence)
+            now = time.time()
+            with self.lock:
+                self.ring.append((now, jpg))
+                self.ring_bytes += len(jpg)
+                while self.ring_bytes > self.buffer_bytes:
+                    self.ring_bytes -= len(self.ring.popleft()[1])
+
+                clip = self.clip
+                if clip is None:
+                    continue
+                if now <= clip["until"] and clip["bytes"] + len(jpg) <= self.max_clip_bytes:
+                    clip["frames"].append(jpg)
+                    clip["bytes"] += len(jpg)
+                    continue
+                self.clip = None
+
+            try:
+                self.pending.put_nowait(clip)
+            except queue.Full:
+                print(f"Clip writer is behind, dropping {clip['name']}")
+
+    def write_clips(self):
+        while True:
+            clip = self.pending.get()
+            path = os.path.join(self.directory, clip["name"])
+            try:
+                with open(path, 'wb') as f:
+                    f.write(b''.join(clip["frames"]))
+            except OSError as e:
+                print(f"Could not save clip {path}: {e}")
@@ -0,0 +1,293 @@
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+import Knock_pattern.binary_code as binary_code
+import QR_code.qr_code_livestream as qr_code
+import tracing
+
+# Configuration
+LOG_STATE = "credential_log.json"  # Server: the version at which every entry last changed
+NODE_STATE = "credential_sync.json"  # Lock node: the server log and version it has synced to, and unreported uses
+SYNC_SERVER = os.environ.get("CREDENTIAL_SERVER")  # e.g. http://door-admin:8000; unset on the server
+SYNC_INTERVAL = 5.0  # Seconds between pulls while the server is reachable
+MAX_BACKOFF = 300.0  # Longest wait between pulls while it is not
+REQUEST_TIMEOUT = 10.0
+
+
+def databases():
+    """Method -> (path, load, save, soft delete by id) of each credential database kept in sync"""
+    return {
+        "morse": (binary_code.DATABASE, binary_code.load_binary_database, binary_code.update_binary_database,
+                  binary_code.delete_binary_password),
+        "qr": (qr_code.QR_DATABASE, qr_code.load_database, qr_code.save_database, qr_code.delete_qr_code),
+    }
+
+
+def load_entries(method):
+    path, load, save, delete = databases()[method]
+    if not os.path.exists(path):
+        return []
+    data = load()
+    return data if isinstance(data, list) else []  # An unused knock database starts as {}
+
+
+def file_state(path):
+    """
+    (inode, size, mtime) of a database file, or None if it is missing. Each save swaps in
+    a new file, so the inode tells apart two saves within the same mtime tick.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class CredentialLog:
+    """
+    Server side of the sync: the authoritative databases are the usual JSON files, and
+    this gives every entry in them the version at which it last changed. Entries are
+    kept in version order, so the changes after a node's version are found by walking
+    back from the newest one, without looking at the rest of the database.
+    The databases are re-read whenever their files change, whoever wrote them.
+    """
+
+    def __init__(self, path=LOG_STATE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file_states = {}  # Method -> file_state() of its database when last read
+        self.entries = {}  # "method:id" -> entry, or None once it has been removed from the file
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+        else:
+            state = {"log_id": secrets.token_hex(4), "version": 0, "stamps": {}}
+        # A new log id tells nodes synced against an earlier log to start over
+        self.log_id = state["log_id"]
+        self.version = state["version"]
+        # "method:id" -> [version, serialised entry], oldest change first
+        self.stamps = OrderedDict(sorted(state["stamps"].items(), key=lambda item: item[1][0]))
+
+    def stamp(self, key, serialised):
+        if key in self.stamps and self.stamps[key][1] == serialised:
+            return False
+        self.version += 1
+        self.stamps[key] = [self.version, serialised]
+        self.stamps.move_to_end(key)
+        return True
+
+    def refresh(self):
+        """Give a new version to every entry that changed since the databases were last read"""
+        changed = False
+        for method, (path, load, save, delete) in databases().items():
+            state = file_state(path)
+            if method in self.file_states and self.file_states[method] == state:
+                continue
+            self.file_states[method] = state
+
+            seen = set()
+            for entry in load_entries(method):
+                key = f"{method}:{entry['id']}"
+                seen.add(key)
+                self.entries[key] = entry
+                changed |= self.stamp(key, json.dumps(entry, sort_keys=True))
+            # Entries removed from the file rather than soft-deleted
+            for key in [key for key in self.stamps if key.startswith(method + ":") and key not in seen]:
+                self.entries[key] = None
+                changed |= self.stamp(key, None)
+
+        if changed:
+            with tracing.span("save_credential_log"):
+                write_json(self.path, {"log_id": self.log_id, "version": self.version, "stamps": self.stamps})
+
+    def changes_since(self, since, log_id=None):
+        """
+        The changes a node at version since of log log_id is missing. A node synced
+        against another log, or none yet, gets a snapshot of every entry instead.
+        """
+        with self.lock:
+            self.refresh()
+            snapshot = log_id != self.log_id or since > self.version
+            changes = []
+            for key in reversed(self.stamps):
+                if not snapshot and self.stamps[key][0] <= since:
+                    break
+                entry = self.entries.get(key)  # None for removed entries
+                if snapshot and entry is None:
+                    continue
+                method, id = key.split(":", 1)
+                changes.append({"method": method, "id": int(id), "entry": entry})
+            changes.reverse()
+            return {"log_id": self.log_id, "version": self.version, "snapshot": snapshot, "changes": changes}
+
+    def consume(self, method, id):
+        """
+        Soft-delete an entry a node has used up (a one-time code or knock), so the other
+        nodes drop it with their next pull. False if there is no such entry.
+        """
+        with self.lock:
+            path, load, save, delete = databases()[method]
+            entry = next((entry for entry in load_entries(method) if entry["id"] == id), None)
+            if entry is None:
+                return False
+            if entry["deletion_time"] is None:  # Reported again after a lost reply
+                delete(id)
+            self.refresh()
+            return True
+
+
+def apply_changes(delta, consumed=()):
+    """
+    Write a delta from the server into the local databases, saving each one once.
+    consumed holds the (method, id) of entries used up on this node that the server has
+    not acknowledged yet; they stay deleted even if the server still has them active.
+    """
+    by_method = {method: [] for method in databases()}
+    for change in delta["changes"]:
+        by_method.setdefault(change["method"], []).append(change)
+
+    for method, changes in by_method.items():
+        if method not in databases() or not (changes or delta["snapshot"]):
+            continue
+        path, load, save, delete = databases()[method]
+        local = OrderedDict((entry["id"], entry) for entry in load_entries(method))
+        # A snapshot replaces the local entries; a delta updates them in place
+        entries = OrderedDict() if delta["snapshot"] else local
+        for change in changes:
+            id, entry = change["id"], change["entry"]
+            if entry is None:
+                entries.pop(id, None)
+            elif (method, id) in consumed and entry["deletion_time"] is None and id in local:
+                entries[id] = local[id]
+            else:
+                entries[id] = entry
+        save(list(entries.values()))
+
+
+class SyncClient(threading.Thread):
+    """
+    Lock node side of the sync: pulls the changes since its last version from the
+    credential server every interval and applies them to the local databases. Unlocks
+    always use the local databases, so the door keeps working while the server is
+    unreachable; pulls then back off and catch up once it is back.
+    Credentials used up on this node are reported to the server before each pull, and
+    kept until it has acknowledged them, so a one-time code works at one door only.
+    """
+
+    def __init__(self, server=SYNC_SERVER, path=NODE_STATE, interval=SYNC_INTERVAL):
+        super().__init__(daemon=True)
+        self.server = server.rstrip("/")
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.wake = threading.Event()  # Set to push and pull before the interval is up
+        self.lock = threading.Lock()
+        self.session = requests.Session()  # Asks for deflate, which the server then sends
+        state = {"log_id": None, "version": 0}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+        self.log_id = state["log_id"]
+        self.version = state["version"]
+        self.consumed = state.get("consumed", [])  # [method, id] used up here, not yet acknowledged
+
+    def save_state(self):
+        with self.lock:
+            write_json(self.path, {"log_id": self.log_id, "version": self.version, "consumed": self.consumed})
+
+    def record_use(self, method, id):
+        """
+        Called after an unlock with a credential of this node: if that used it up (it is
+        now soft-deleted locally), queue it to be reported to the server.
+        """
+        if method not in databases() or id is None:
+            return
+        if not any(entry["id"] == id and entry["deletion_time"] is not None for entry in load_entries(method)):
+            return  # Still active, e.g. a QR code that can be used again
+        with self.lock:
+            if [method, id] in self.consumed:
+                return
+            self.consumed.append([method, id])
+        self.save_state()
+        self.wake.set()
+
+    def push(self):
+        """Report the credentials used up here to the server; returns how many there were"""
+        with self.lock:
+            pending = list(self.consumed)
+        for method, id in pending:
+            response = self.session.post(f"{self.server}/sync/consumed", json={"method": method, "id": id},
+                                         timeout=REQUEST_TIMEOUT)
+            if response.status_code != 404:  # 404: the server no longer has it either
+                response.raise_for_status()
+            with self.lock:
+                self.consumed.remove([method, id])
+            self.save_state()
+        return len(pending)
+
+    def pull(self):
+        """Fetch and apply the changes since the last pull; returns how many there were"""
+        with tracing.span("credential_sync"):
+            response = self.session.get(f"{self.server}/sync/changes", timeout=REQUEST_TIMEOUT,
+                                        params={"since": self.version, "log_id": self.log_id or ""})
+            response.raise_for_status()
+            delta = response.json()
+            with self.lock:
+                consumed = {(method, id) for method, id in self.consumed}
+            apply_changes(delta, consumed)
+            self.log_id, self.version = delta["log_id"], delta["version"]
+            self.save_state()
+        return len(delta["changes"])
+
+    def run(self):
+        delay = self.interval
+        while not self.stop_event.is_set():
+            try:
+                if self.push():
+                    print("Reported used credentials to the server")
+                count = self.pull()
+                if count:
+                    print(f"Synced {count} credential changes, now at version {self.version}")
+                delay = self.interval
+            except (requests.RequestException, ValueError, KeyError) as e:
+                delay = min(delay * 2, MAX_BACKOFF)
+                print(f"Credential sync failed, retrying in {delay:.0f} s: {e}")
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep this lock node\'s credentials in sync with the credential server.')
+    parser.add_argument('--server', default=SYNC_SERVER, required=SYNC_SERVER is None,
+                        help='Base URL of the credential server (default: $CREDENTIAL_SERVER)')
+    parser.add_argument('--interval', type=float, default=SYNC_INTERVAL, help='Seconds between pulls')
+    parser.add_argument('--once', action='store_true', help='Pull once and exit')
+    args = parser.parse_args()
+
+    client = SyncClient(args.server, interval=args.interval)
+    if args.once:
+        print(f"Applied {client.pull()} changes, now at version {client.version}")
+    else:
+        client.start()
+        try:
+            while client.is_alive():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            client.stop()
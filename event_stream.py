@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+
+QUEUE_SIZE = 64  # Events buffered per client before it is considered too slow
+KEEPALIVE_INTERVAL = 15  # Seconds between keep-alive comments on an idle stream
+
+
+class EventBroadcaster:
+    """
+    Fan out events to every connected client through its own bounded queue.
+    A client whose queue fills up is dropped instead of slowing down the others.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.loop = None
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event_type, data):
+        """Publish an event; safe to call from any thread"""
+        with self.lock:
+            event_id = self.next_id
+            self.next_id += 1
+        message = (f"id: {event_id}\n"
+                   f"event: {event_type}\n"
+                   f"data: {json.dumps(data)}\n\n")
+
+        if self.loop is None:
+            return  # Nobody has subscribed yet
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.deliver(message)
+        else:
+            self.loop.call_soon_threadsafe(self.deliver, message)
+
+    def deliver(self, message):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: make room for the end-of-stream marker and drop it
+                self.subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def stream(self):
+        """Yield Server-Sent Events for one client until it disconnects or falls behind"""
+        queue = self.subscribe()
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+
+broadcaster = EventBroadcaster()
@@ -1,103 +1,189 @@
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
-from picamera import PiCamera
-import io
 import threading
-import queue
-from time import sleep
+import time
 import cv2
 import numpy as np
-from PIL import Image
+from camera_capture import FrameOutput, RawFrameOutput, FrameBroadcaster, create_camera_source, RESOLUTION
+from event_stream import EventBroadcaster
+from frame_bus import FrameBus
+from object_detection import CLASSES
+from sensing_pool import SensingError, pool
 
 app = FastAPI()
 
 # Global variables
-output_queue = queue.Queue(maxsize=1)
-camera = PiCamera()
-camera.resolution = (640, 480)
-camera.framerate = 30
-sleep(2)  # Allow camera to warm up
-
-# Load pre-trained MobileNet SSD model for object detection
-net = cv2.dnn.readNetFromCaffe(
-    "MobileNet-SSD/deploy.prototxt",
-    "MobileNet-SSD/mobilenet_iter_73000.caffemodel"
-)
-CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
-           "bottle", "bus", "car", "cat", "chair", "cow", "diningtable",
-           "dog", "horse", "motorbike", "person", "pottedplant", "sheep",
-           "sofa", "train", "tvmonitor"]
+JPEG_QUALITY = 80  # Quality of the single encode each streamed frame goes through
+annotated_output = FrameOutput()  # Camera frames with the latest detections drawn on
+broadcaster = FrameBroadcaster(annotated_output)
+events = EventBroadcaster()  # Presence changes for /detections/events
+
+# Raw BGR camera frames at full rate: straight from livestream.py's frame bus when it is
+# running, otherwise from a camera of our own
+try:
+    camera_output = FrameBus.attach()
+    camera = None
+except FileNotFoundError:
+    camera_output = RawFrameOutput(RESOLUTION)
+    camera = create_camera_source(resolution=RESOLUTION)
+
+# Motion gate: the network only runs when the scene changes, or every KEEP_ALIVE seconds
+MOTION_CHECK_INTERVAL = 0.1  # Seconds between motion checks while the scene is static
+PIXEL_THRESHOLD = 25  # Grey-level change for a pixel to count as moving
+MOTION_THRESHOLD = 0.01  # Fraction of moving pixels that triggers inference
+KEEP_ALIVE = 30  # Seconds after which inference runs even without motion
+BACKGROUND_RATE = 0.05  # How quickly the background model follows slow changes such as light
+
+# A person must be seen (or missed) for this long before presence changes
+PRESENCE_DEBOUNCE = 1.0
+
+# Latest detections as (time of the frame they came from, [(class index, confidence, box)]),
+# with boxes as (startX, startY, endX, endY) fractions of the frame size
+latest_detections = (None, [])
+
 COLORS = np.random.uniform(0, 255, size=(len(CLASSES), 3))
 
-def detect_objects(frame):
-    # Convert to blob for DNN
+def draw_detections(frame, detected_at, detections):
     (h, w) = frame.shape[:2]
-    blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 0.007843, (300, 300), 127.5)
-    
-    # Pass blob through network and get detections
-    net.setInput(blob)
-    detections = net.forward()
-    
-    # Process detections
-    for i in np.arange(0, detections.shape[2]):
-        confidence = detections[0, 0, i, 2]
-        
-        if confidence > 0.5:  # Filter weak detections
-            idx = int(detections[0, 0, i, 1])
-            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-            (startX, startY, endX, endY) = box.astype("int")
-            
-            # Draw bounding box and label
-            label = f"{CLASSES[idx]}: {confidence*100:.2f}%"
-            cv2.rectangle(frame, (startX, startY), (endX, endY), COLORS[idx], 2)
-            y = startY - 15 if startY - 15 > 15 else startY + 15
-            cv2.putText(frame, label, (startX, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, COLORS[idx], 2)
-    
+    for idx, confidence, box in detections:
+        (startX, startY, endX, endY) = (np.array(box) * np.array([w, h, w, h])).astype("int")
+
+        # Draw bounding box and label
+        label = f"{CLASSES[idx]}: {confidence*100:.2f}%"
+        cv2.rectangle(frame, (startX, startY), (endX, endY), COLORS[idx], 2)
+        y = startY - 15 if startY - 15 > 15 else startY + 15
+        cv2.putText(frame, label, (startX, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, COLORS[idx], 2)
+
+    # Show how old the detections are, since they lag behind the live picture
+    if detected_at is not None:
+        age = time.time() - detected_at
+        cv2.putText(frame, f"detections {age*1000:.0f} ms old", (10, h - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
     return frame
 
-def capture_frames():
+def motion_detected(gray, background):
+    """Compare a small greyscale frame with the running background and fold it in"""
+    gray = cv2.GaussianBlur(gray, (5, 5), 0, dst=gray)
+    if background is None:
+        return True, gray.astype("float")
+
+    diff = cv2.absdiff(gray, cv2.convertScaleAbs(background))
+    moving = np.count_nonzero(diff > PIXEL_THRESHOLD) / diff.size
+    cv2.accumulateWeighted(gray, background, BACKGROUND_RATE)
+    return moving > MOTION_THRESHOLD, background
+
+class PresenceTracker:
+    """Debounced "is there a person at the door" state built from successive detections"""
+
+    def __init__(self, debounce=PRESENCE_DEBOUNCE):
+        self.debounce = debounce
+        self.present = False
+        self.changing_since = None  # When detections started disagreeing with self.present
+
+    @property
+    def settling(self):
+        """True while a change is waiting out the debounce; inference should keep running"""
+        return self.changing_since is not None
+
+    def update(self, detected_at, detections):
+        """Feed one inference result; returns True when the presence state flips"""
+        person = any(CLASSES[idx] == "person" for idx, _, _ in detections)
+        if person == self.present:
+            self.changing_since = None
+            return False
+        if self.changing_since is None:
+            self.changing_since = detected_at
+        if detected_at - self.changing_since < self.debounce:
+            return False
+        self.present = person
+        self.changing_since = None
+        return True
+
+presence = PresenceTracker()
+
+def run_inference():
+    """
+    Detect objects on the newest camera frame, as often as the CPU allows, but only when
+    the motion gate sees a change; otherwise the previous detections stay in use
+    """
+    global latest_detections
+    frame = camera_output.new_frame_buffer()
+    (h, w) = frame.shape[:2]
+    small = np.empty((h // 4, w // 4, 3), dtype=np.uint8)
+    gray = np.empty((h // 4, w // 4), dtype=np.uint8)
+    sequence = 0
+    background = None
+    last_inference = 0
     while True:
-        stream = io.BytesIO()
-        camera.capture(stream, format='jpeg', use_video_port=True)
-        stream.seek(0)
-        
-        # Convert to numpy array for processing
-        image = Image.open(stream)
-        frame = np.array(image)
-        
-        # Perform object detection
-        frame = detect_objects(frame)
-        
-        # Convert back to bytes
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
-        
-        # Keep only the most recent frame
+        sequence = camera_output.read_frame_into(frame, sequence)
+        captured_at = time.time()
+
+        # The motion check works on a quarter-size greyscale copy
+        cv2.resize(frame, (w // 4, h // 4), dst=small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=gray)
+        moved, background = motion_detected(gray, background)
+        if not moved and not presence.settling and captured_at - last_inference < KEEP_ALIVE:
+            time.sleep(MOTION_CHECK_INTERVAL)
+            continue
+
+        # The network runs on a worker process, so it never holds this process's GIL
         try:
-            output_queue.get_nowait()
-        except queue.Empty:
-            pass
-        output_queue.put(frame_bytes)
-        
-        stream.close()
-
-# Start the capture thread
-capture_thread = threading.Thread(target=capture_frames, daemon=True)
-capture_thread.start()
-
-def generate_frames():
+            detections = pool.submit("detect_objects", frame)
+        except SensingError as e:
+            print(f"Object detection failed: {e}")
+            continue
+        latest_detections = (captured_at, detections)
+        last_inference = captured_at
+        if presence.update(captured_at, detections):
+            events.publish("presence", {"present": presence.present, "timestamp": captured_at})
+
+def annotate_frames():
+    """Draw the latest detections on every camera frame and encode it once for the stream"""
+    frame = camera_output.new_frame_buffer()
+    sequence = 0
     while True:
-        frame = output_queue.get()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        sequence = camera_output.read_frame_into(frame, sequence)
+        detected_at, detections = latest_detections
+        draw_detections(frame, detected_at, detections)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        annotated_output.write(memoryview(buffer).cast('B'))
+
+# Capture, inference and annotation each run at their own pace
+pool.start(kinds=("detect_objects",))
+if camera is not None:
+    camera.start(camera_output, format='bgr')
+inference_thread = threading.Thread(target=run_inference, daemon=True)
+inference_thread.start()
+annotate_thread = threading.Thread(target=annotate_frames, daemon=True)
+annotate_thread.start()
 
 @app.get('/video_feed')
 async def video_feed():
     return StreamingResponse(
-        generate_frames(),
+        broadcaster.frames(),
         media_type='multipart/x-mixed-replace; boundary=frame'
     )
 
+@app.get('/detections')
+async def get_detections():
+    """Latest detections; boxes are (startX, startY, endX, endY) as fractions of the frame"""
+    detected_at, detections = latest_detections
+    return {
+        "timestamp": detected_at,
+        "person_present": presence.present,
+        "detections": [{"class": CLASSES[idx], "confidence": confidence, "box": box}
+                       for idx, confidence, box in detections],
+    }
+
+@app.get('/detections/events')
+async def detection_events():
+    """Server-Sent Events stream of debounced person presence changes"""
+    return StreamingResponse(
+        events.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=8081)
\ No newline at end of file
+    uvicorn.run(app, host='0.0.0.0', port=8081)
@@ -0,0 +1,135 @@
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from camera_capture import RawFrameOutput, FRAME_SLOTS, RESOLUTION, padded_shape
+
+# Configuration
+BUS_NAME = os.environ.get("FRAME_BUS", "door_lock_frames")
+POLL_INTERVAL = 0.005  # Seconds between checks for a new frame while a reader waits
+
+# Layout: a header of uint64 fields, the sequence number of each slot, then the frames
+MAGIC = 0x46524D42  # "FRMB"
+MAGIC_FIELD, WIDTH_FIELD, HEIGHT_FIELD, SLOTS_FIELD, LATEST_FIELD, LATEST_TIME_FIELD = range(6)
+HEADER_FIELDS = 8
+FRAMES_ALIGN = 64
+
+
+def frames_offset(slots):
+    return ((HEADER_FIELDS + slots) * 8 + FRAMES_ALIGN - 1) & ~(FRAMES_ALIGN - 1)
+
+
+class FrameBus(RawFrameOutput):
+    """
+    Raw BGR camera frames shared between processes through a multiprocessing.shared_memory
+    ring, so the QR scanner and the detector read the camera's pixels directly instead of
+    pulling JPEGs over HTTP and decoding them.
+
+    The process that owns the camera creates the bus and records into it like any
+    RawFrameOutput. Other processes attach() by name and use read_frame_into() to copy a
+    frame out, or frame_view() to work on the ring slot itself without any copy.
+    Each slot carries the sequence number of the frame in it: the writer zeroes it before
+    overwriting the slot and sets it once the frame is complete, so a reader that checks it
+    after using a frame knows whether the frame changed underneath it.
+    """
+
+    def __init__(self, shm, resolution, slots, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=shm.buf)
+        shape = padded_shape(resolution)
+        frame_bytes = shape[0] * shape[1] * shape[2]
+        frames = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=frames_offset(slots) + i * frame_bytes)
+                  for i in range(slots)]
+        super().__init__(resolution, slots, frames)
+        self.slot_sequence = np.ndarray((slots,), dtype=np.uint64, buffer=shm.buf, offset=HEADER_FIELDS * 8)
+
+    @classmethod
+    def create(cls, name=BUS_NAME, resolution=RESOLUTION, slots=FRAME_SLOTS):
+        """Create the bus in the camera process, replacing one left behind by a crashed run"""
+        shape = padded_shape(resolution)
+        size = frames_offset(slots) + slots * shape[0] * shape[1] * shape[2]
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        bus = cls(shm, resolution, slots, owner=True)
+        bus.header[:] = 0
+        bus.slot_sequence[:] = 0
+        bus.header[WIDTH_FIELD], bus.header[HEIGHT_FIELD] = resolution
+        bus.header[SLOTS_FIELD] = slots
+        bus.header[MAGIC_FIELD] = MAGIC  # Last, so readers never see a half-initialised bus
+        return bus
+
+    @classmethod
+    def attach(cls, name=BUS_NAME):
+        """Map a bus created by another process; raises FileNotFoundError if there is none"""
+        shm = shared_memory.SharedMemory(name=name)
+        # Before Python 3.13 attaching also registers the segment for removal when this
+        # process exits, which would pull it from under the camera process
+        resource_tracker.unregister(shm._name, "shared_memory")
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=shm.buf)
+        if header[MAGIC_FIELD] != MAGIC:
+            shm.close()
+            raise FileNotFoundError(f"Frame bus '{name}' is not initialised")
+        resolution = (int(header[WIDTH_FIELD]), int(header[HEIGHT_FIELD]))
+        slots = int(header[SLOTS_FIELD])
+        del header
+        return cls(shm, resolution, slots, owner=False)
+
+    def publish(self):
+        super().publish()
+        self.header[LATEST_TIME_FIELD] = time.monotonic_ns()  # The monotonic clock is system-wide
+        self.header[LATEST_FIELD] = self.sequence
+
+    def latest_sequence(self):
+        return int(self.header[LATEST_FIELD])
+
+    def frame_age(self):
+        """Seconds since the newest frame was published, or None if there has been none"""
+        published = int(self.header[LATEST_TIME_FIELD])
+        return (time.monotonic_ns() - published) / 1e9 if published else None
+
+    def is_current(self, sequence):
+        """True while the frame with this sequence number is still in its slot, unchanged"""
+        return int(self.slot_sequence[(sequence - 1) % len(self.frames)]) == sequence
+
+    def frame_view(self, last_sequence=0, timeout=None):
+        """
+        Wait for a frame newer than last_sequence and return (sequence, view of it in the ring).
+        Returns (last_sequence, None) on timeout. The view is only valid while
+        is_current(sequence) holds; check it after using the frame and discard the result if not.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sequence = self.latest_sequence()
+            if sequence > last_sequence:
+                slot = (sequence - 1) % len(self.frames)
+                if int(self.slot_sequence[slot]) == sequence:
+                    return sequence, self.frames[slot][:self.height, :self.width]
+            if deadline is not None and time.monotonic() >= deadline:
+                return last_sequence, None
+            time.sleep(POLL_INTERVAL)
+
+    def read_frame_into(self, out, last_sequence=0, timeout=None):
+        """Like RawFrameOutput.read_frame_into(), but works from any process"""
+        while True:
+            sequence, view = self.frame_view(last_sequence, timeout)
+            if view is None:
+                return last_sequence
+            np.copyto(out, view)
+            if self.is_current(sequence):
+                return sequence
+
+    def close(self):
+        # Views into the segment must go before it can be unmapped
+        self.header = self.slot_sequence = None
+        self.frames = self.buffers = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,124 @@
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from metrics import FRAME_PIPELINE_RESTARTS
+
+# Configuration: frame pipeline SLOs, overridable from the environment
+MAX_FRAME_AGE = float(os.environ.get("FRAME_MAX_AGE", 1.0))  # Seconds since the newest frame
+MAX_FRAME_INTERVAL = float(os.environ.get("FRAME_MAX_INTERVAL", 0.25))  # p99 seconds between frames
+FRESH_FRAME_TIMEOUT = 2.0  # Seconds an unlock attempt waits for a fresh frame before failing
+INTERVAL_WINDOW = 300  # Recent inter-frame intervals the p99 is taken over
+CHECK_INTERVAL = 0.25  # Seconds between watchdog checks
+STARTUP_GRACE = 5.0  # Seconds a (re)started component gets to deliver its first frame
+RESTART_BACKOFF = 1.0  # Seconds before the first restart of a stalled component...
+MAX_RESTART_BACKOFF = 60.0  # ...doubling after each restart that does not bring frames back
+
+
+class NoFreshFrame(RuntimeError):
+    """An unlock attempt found no frame recent enough to scan"""
+
+
+class FrameWatchdog(threading.Thread):
+    """
+    Tracks frame age and inter-frame intervals of a capture component against the SLOs
+    above and calls restart() when it stalls, backing off while restarts do not help.
+    frame_arrived() goes into the output's listeners and only records the time, so it is
+    cheap enough for the capture thread. health() reports one of "starting", "healthy",
+    "degraded" (frames arrive, but too unevenly), "stalled" or "restarting".
+    """
+
+    def __init__(self, name, restart, max_age=MAX_FRAME_AGE, max_interval=MAX_FRAME_INTERVAL,
+                 check_interval=CHECK_INTERVAL):
+        super().__init__(daemon=True)
+        self.name = name
+        self.restart = restart
+        self.max_age = max_age
+        self.max_interval = max_interval
+        self.check_interval = check_interval
+        self.frame_times = collections.deque(maxlen=INTERVAL_WINDOW + 1)
+        self.started_at = time.monotonic()
+        self.state = "starting"
+        self.restarts = 0
+        self.last_restart = None
+        self.last_error = None
+        self.backoff = RESTART_BACKOFF
+        self.next_restart = 0
+        self.running = True
+
+    def frame_arrived(self, sequence=None):
+        self.frame_times.append(time.monotonic())
+
+    def frame_age(self):
+        """Seconds since the newest frame, or None before the first one"""
+        try:
+            # Indexed directly: a restart may clear the deque between a check and the read
+            return time.monotonic() - self.frame_times[-1]
+        except IndexError:
+            return None
+
+    def interval_p99(self):
+        times = list(self.frame_times)  # Snapshot; the capture thread keeps appending
+        if len(times) < 2:
+            return None
+        return float(np.percentile(np.diff(times), 99))
+
+    def evaluate(self):
+        age = self.frame_age()
+        since_start = time.monotonic() - self.started_at
+        if age is None:
+            return "starting" if since_start < STARTUP_GRACE else "stalled"
+        if age > self.max_age:
+            return "stalled"
+        p99 = self.interval_p99()
+        if p99 is not None and p99 > self.max_interval:
+            return "degraded"
+        return "healthy"
+
+    def run(self):
+        while self.running:
+            self.state = self.evaluate()
+            now = time.monotonic()
+            if self.state == "healthy":
+                self.backoff = RESTART_BACKOFF
+            elif self.state == "stalled" and now >= self.next_restart:
+                self.restart_component()
+            time.sleep(self.check_interval)
+
+    def restart_component(self):
+        age = self.frame_age()
+        print(f"{self.name} stalled (last frame {'never' if age is None else f'{age:.1f} s ago'}), restarting")
+        self.state = "restarting"
+        self.frame_times.clear()  # Intervals from before the restart say nothing about after it
+        FRAME_PIPELINE_RESTARTS.labels(component=self.name).inc()
+        try:
+            self.restart()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Could not restart {self.name}: {self.last_error}")
+        self.restarts += 1
+        self.last_restart = time.time()
+        self.started_at = time.monotonic()
+        self.next_restart = self.started_at + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_RESTART_BACKOFF)
+
+    def stop(self):
+        self.running = False
+
+    def health(self):
+        age = self.frame_age()
+        p99 = self.interval_p99()
+        return {
+            "component": self.name,
+            "state": self.state,
+            "frame_age": age,
+            "interval_p99": p99,
+            "slo": {"max_frame_age": self.max_age, "max_frame_interval": self.max_interval},
+            "restarts": self.restarts,
+            "last_restart": self.last_restart,
+            "last_error": self.last_error,
+        }
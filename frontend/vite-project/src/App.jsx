@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import './App.css'
 
 const RASPBERRY_PI_IP = "192.168.50.190"; // ← EDIT THIS
@@ -15,11 +15,7 @@ function App() {
   };
   
   const [currentDateTime] = useState(getCurrentDateTime())
-  const [notices, setNotices] = useState([
-    { id: 1, date: currentDateTime.date, time: currentDateTime.time, message: 'Door unlocked', method: 'Voice' },
-    { id: 2, date: '2025-05-12', time: '14:35', message: 'Door unlocked', method: 'QR Code' },
-    { id: 3, date: '2025-05-12', time: '09:17', message: 'Access denied', method: 'Morse Code' },
-  ])
+  const [notices, setNotices] = useState([]) // Filled from the /events stream
   const [isFullScreen, setIsFullScreen] = useState(false)
   const [showManageModal, setShowManageModal] = useState(false)
   const [activeMethod, setActiveMethod] = useState(null) // 'qr', 'morse', or 'voice'
@@ -40,6 +36,9 @@ function App() {
   const [nextMorseId, setNextMorseId] = useState(2)
   const [nextVoiceId, setNextVoiceId] = useState(2)
   
+  // Last ETag returned by /update_database for each method
+  const dbEtags = useRef({})
+
   const [editingPass, setEditingPass] = useState(null)
   const [isCreatingPass, setIsCreatingPass] = useState(false)
   const [sortField, setSortField] = useState('name') // Default sort by name
@@ -226,31 +225,52 @@ function App() {
   /* APIs */
   const update_database = async () => {
     try {
-      const response = await fetch('http://localhost:8000/update_database', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          method: activeMethod,
-        })});
-
-      if (response.ok) {
-        let data = await response.json();
-        // Update morse code database
-        if (activeMethod === "morse"){
-          const newPasses = data.map(item => ({
-            id: item.id,
-            name: item.name,
-            type: 'one-time',
-            expiryTime: item.expiration_time,
-            morsePassword: item.knock_password,
-            binaryPassword: item.password,
-            knockPassword: item.knock_password.substring(0, morsePassword.length-1),
-          }));
+      let items = [];
+      let cursor = null;
+      let etag = null;
+      do {
+        const isFirstPage = cursor === null;
+        const response = await fetch('http://localhost:8000/update_database', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            // Only the first page is revalidated: if it is unchanged, so is the rest
+            ...(isFirstPage && dbEtags.current[activeMethod] && {
+              'If-None-Match': dbEtags.current[activeMethod],
+            }),
+          },
+          // No name or type filter: the list shows every pass of the method
+          body: JSON.stringify({
+            method: activeMethod,
+            cursor: cursor,
+          })});
 
-          setMorsePasses(newPasses);
+        if (response.status === 304 || !response.ok) {
+          return;
         }
+        if (isFirstPage) {
+          etag = response.headers.get('ETag');
+        }
+        const data = await response.json();
+        items = items.concat(data.items);
+        cursor = data.next_cursor;
+      } while (cursor !== null);
+
+      dbEtags.current[activeMethod] = etag;
+      let data = items;
+      // Update morse code database
+      if (activeMethod === "morse"){
+        const newPasses = data.map(item => ({
+          id: item.id,
+          name: item.name,
+          type: item.type || 'one-time', // Older entries were saved without a type
+          expiryTime: item.expiration_time,
+          morsePassword: item.knock_password,
+          binaryPassword: item.password,
+          knockPassword: item.knock_password.substring(0, morsePassword.length-1),
+        }));
+
+        setMorsePasses(newPasses);
       }
     } catch (error) {
       console.error('Error deleting Morse code:', error);
@@ -410,21 +430,47 @@ function App() {
   const addNotice = (message, method) => {
     const { date, time } = getCurrentDateTime();
     
-    // Get the next notice ID (latest ID + 1)
-    const nextId = notices.length > 0 
-      ? Math.max(...notices.map(notice => notice.id)) + 1 
-      : 1;
-    
-    const newNotice = {
-      id: nextId,
-      date,
-      time,
-      message,
-      method
-    };
-    setNotices([newNotice, ...notices].slice(0, 20)); // Keep only the last 20 notices
+    setNotices(notices => {
+      // Get the next notice ID (latest ID + 1)
+      const nextId = notices.length > 0 
+        ? Math.max(...notices.map(notice => notice.id)) + 1 
+        : 1;
+
+      const newNotice = {
+        id: nextId,
+        date,
+        time,
+        message,
+        method
+      };
+      return [newNotice, ...notices].slice(0, 20); // Keep only the last 20 notices
+    });
   };
 
+  // The event stream handlers are set up once, so they reach the latest callbacks through refs
+  const latestCallbacks = useRef({})
+  latestCallbacks.current = { addNotice, update_database, activeMethod }
+
+  // Receive unlock attempts and credential changes pushed by the server
+  useEffect(() => {
+    const methodNames = { qr: 'QR Code', morse: 'Morse Code', voice: 'Voice' };
+    const events = new EventSource('http://localhost:8000/events');
+
+    events.addEventListener('access', (e) => {
+      const event = JSON.parse(e.data);
+      latestCallbacks.current.addNotice(event.unlocked ? 'Door unlocked' : 'Access denied',
+                                        methodNames[event.method] || event.method);
+    });
+    events.addEventListener('credentials', (e) => {
+      const event = JSON.parse(e.data);
+      if (event.method === latestCallbacks.current.activeMethod) {
+        latestCallbacks.current.update_database();
+      }
+    });
+
+    return () => events.close();
+  }, []);
+
   // Update pass
   const updatePass = (updatedPass) => {
     // Update in appropriate pass list based on active method
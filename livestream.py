@@ -1,50 +1,80 @@
-from fastapi import FastAPI
+import atexit
+from fastapi import FastAPI, HTTPException, Query, Response
+from typing import Optional
 from fastapi.responses import StreamingResponse
-from picamera import PiCamera
-import io
-import threading
-import queue
-from time import sleep
+from pydantic import BaseModel
+from camera_capture import FrameOutput, FrameBroadcaster, create_camera_source
+from clip_recorder import REASON_PATTERN, ClipRecorder
+from frame_bus import FrameBus
+from frame_watchdog import FrameWatchdog
 
 app = FastAPI()
 
 # Global variables
-output_queue = queue.Queue(maxsize=1)
-camera = PiCamera()
-camera.resolution = (640, 480)
-camera.framerate = 30
-sleep(2)  # Allow camera to warm up
-
-def capture_frames():
-    while True:
-        stream = io.BytesIO()
-        camera.capture(stream, format='jpeg', use_video_port=True)
-        # Keep only the most recent frame
-        try:
-            output_queue.get_nowait()
-        except queue.Empty:
-            pass
-        output_queue.put(stream.getvalue())
-        stream.seek(0)
-        stream.truncate()
-
-# Start the capture thread
-capture_thread = threading.Thread(target=capture_frames, daemon=True)
-capture_thread.start()
-
-def generate_frames():
-    while True:
-        frame = output_queue.get()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+output = FrameOutput()
+broadcaster = FrameBroadcaster(output)
+recorder = ClipRecorder(output)  # Saves footage around unlock attempts
+bus = FrameBus.create()  # Raw frames for the QR scanner and detector processes
+camera = None
+
+def start_camera():
+    """
+    Record continuously; the encoder hands each JPEG straight to the output, and a second
+    splitter port writes the same frames uncompressed into the shared-memory bus.
+    Set CAMERA_SOURCE=synthetic or file:<path> to run without a Pi camera
+    """
+    global camera
+    camera = create_camera_source()
+    camera.start(output)
+    camera.start(bus, format='bgr', splitter_port=2)
+
+def restart_camera():
+    """Called by the watchdog when frames stop: replace the camera source with a new one"""
+    try:
+        camera.stop()
+    except Exception as e:
+        print(f"Could not stop the stalled camera: {e}")
+    output.reset()
+    bus.reset()
+    start_camera()
+
+# Restarts the camera when frames stop arriving; its state is served at /health
+watchdog = FrameWatchdog("camera", restart_camera)
+output.listeners.append(watchdog.frame_arrived)
+start_camera()
+watchdog.start()
+recorder.start()
+atexit.register(bus.close)
+
+class ClipRequest(BaseModel):
+    reason: str
 
 @app.get('/video_feed')
-async def video_feed():
+async def video_feed(width: Optional[int] = Query(None, ge=16, le=640),
+                     quality: Optional[int] = Query(None, ge=1, le=100),
+                     max_fps: Optional[float] = Query(None, gt=0)):
+    # Every client gets its own generator over the shared latest frame; clients asking
+    # for the same width and quality share one transcoded copy of each frame
     return StreamingResponse(
-        generate_frames(),
+        broadcaster.frames(width, quality, max_fps),
         media_type='multipart/x-mixed-replace; boundary=frame'
     )
 
+@app.get('/health')
+async def health(response: Response):
+    """Frame age and inter-frame interval of the camera against their SLOs, and its restarts"""
+    state = watchdog.health()
+    if state["state"] in ("stalled", "restarting"):
+        response.status_code = 503
+    return state
+
+@app.post('/clip')
+async def save_clip(request: ClipRequest):
+    """Save the footage from just before until just after now, e.g. on an unlock attempt"""
+    if not REASON_PATTERN.fullmatch(request.reason):
+        raise HTTPException(status_code=422, detail="reason must be 1-64 letters, digits, '_' or '-'")
+    recorder.trigger(request.reason)
+
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=8080)
\ No newline at end of file
+    uvicorn.run(app, host='0.0.0.0', port=8080)
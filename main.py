@@ -1,14 +1,32 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from Knock_pattern.binary_code import load_binary_database, add_binary_password, edit_binary_password, delete_binary_password
-from typing import Optional
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from event_stream import broadcaster
+from access_log import access_log
+import metrics
+from Knock_pattern.binary_code import load_binary_database, update_binary_database, add_binary_password, edit_binary_password, delete_binary_password, get_database_version, query_binary_passwords, prepare_binary_operations
+from QR_code.qr_code_livestream import load_database as load_qr_database, save_database as save_qr_database, prepare_qr_operations
+from credential_sync import CredentialLog
+from unlock_jobs import METHODS, UnlockJobQueue
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, conint
 import json
 import datetime
+import secrets
+import zlib
 
 app = FastAPI()
 
+# Distinguishes ETags issued before and after a server restart
+INSTANCE_ID = secrets.token_hex(4)
+
+# Latest metrics snapshot pushed by each of the other processes (e.g. the door unlocker)
+pushed_metrics = {}
+
+# Versions of the credential entries, for lock nodes syncing from this server
+credential_log = CredentialLog()
+
 # Allow CORS for all origins (or specify the frontend URL)
 app.add_middleware(
     CORSMiddleware,
@@ -16,6 +34,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all HTTP methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["ETag"],  # Lets the frontend read the ETag for If-None-Match
 )
 
 class EditEntry(BaseModel):
@@ -31,15 +50,59 @@ class DeleteByID(BaseModel):
     id: int
     method: str
 
+class BatchOperation(BaseModel):
+    op: str  # "add", "edit" or "delete"
+    method: str
+    id: Optional[int] = None
+    name: Optional[str] = None
+    type: Optional[str] = None
+    expiration_time: Optional[str] = None
+    knock_password: Optional[str] = None
+    password: Optional[str] = None
+
+class Batch(BaseModel):
+    operations: List[BatchOperation]
+
+class AccessEvent(BaseModel):
+    method: str
+    unlocked: bool
+    credential_id: Optional[conint(ge=0, lt=2**31)] = None  # Stored as int32, -1 meaning unknown
+    latency: float = 0.0  # Seconds from button press to result
+
+class MetricsPush(BaseModel):
+    source: str
+    metrics: Dict[str, Any]
+
+class ConsumedCredential(BaseModel):
+    method: str
+    id: int
+
 class LoadDB(BaseModel):
     method: str
+    name: Optional[str] = None
+    type: Optional[str] = None
+    expiring_before: Optional[str] = None
+    cursor: Optional[int] = None
+    limit: int = 100
 
 
 @app.post("/update_database")
-async def load_database(request: LoadDB):
+async def load_database(request: LoadDB, response: Response, if_none_match: Optional[str] = Header(None)):
     if request.method == "morse":
-        data = load_binary_database()
-        return [item for item in data if item["deletion_time"] is None]
+        if request.limit < 1:
+            raise HTTPException(status_code=422, detail="limit must be positive")
+
+        # The ETag covers both the database version and the query, so a page is only
+        # reported unchanged when the same query would return the same result
+        query = json.dumps(request.dict(), sort_keys=True).encode()
+        etag = f'"{INSTANCE_ID}-{get_database_version()}-{zlib.crc32(query):08x}"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        items, next_cursor = query_binary_passwords(request.name, request.type, request.expiring_before,
+                                                    request.cursor, request.limit)
+        response.headers["ETag"] = etag
+        return {"items": items, "next_cursor": next_cursor}
 
     # Or you may update both DBs, up to you :)
     elif request.method == "qr":
@@ -48,7 +111,9 @@ async def load_database(request: LoadDB):
 @app.post("/add_entry")
 async def add_entry(request: EditEntry):
     if request.method == "morse":
-        return add_binary_password(request.id, request.name, request.expiration_time, request.knock_password, request.password)
+        data = add_binary_password(request.id, request.name, request.expiration_time, request.knock_password, request.password, request.type)
+        broadcaster.publish("credentials", {"method": "morse", "action": "add", "ids": [request.id]})
+        return data
 
     elif request.method == "qr":
         pass
@@ -56,13 +121,167 @@ async def add_entry(request: EditEntry):
 @app.post("/edit_entry")
 async def edit_entry(request: EditEntry):
     if request.method == "morse":
-        return edit_binary_password(request.id, request.name, request.expiration_time, request.knock_password, request.password)
+        data = edit_binary_password(request.id, request.name, request.expiration_time, request.knock_password, request.password, request.type)
+        broadcaster.publish("credentials", {"method": "morse", "action": "edit", "ids": [request.id]})
+        return data
     elif request.method == "qr":
         pass
 
 @app.post("/delete_entry")
 async def delete_entry(request: DeleteByID):
     if request.method == "morse":
-        return delete_binary_password(request.id)
+        data = delete_binary_password(request.id)
+        broadcaster.publish("credentials", {"method": "morse", "action": "delete", "ids": [request.id]})
+        return data
     elif request.method == "qr":
-        pass
\ No newline at end of file
+        pass
+
+@app.post("/batch")
+async def batch(request: Batch):
+    # Split the operations per database, remembering where each one came from
+    preparers = {"morse": prepare_binary_operations, "qr": prepare_qr_operations}
+    databases = {"morse": (load_binary_database, update_binary_database), "qr": (load_qr_database, save_qr_database)}
+    grouped = {method: [] for method in preparers}
+    results = [None] * len(request.operations)
+    for index, operation in enumerate(request.operations):
+        if operation.method not in preparers:
+            results[index] = {"id": operation.id, "status": "error", "detail": f"unknown method '{operation.method}'"}
+        else:
+            # Only the fields the client sent, so a partial edit leaves the others alone
+            grouped[operation.method].append((index, operation.dict(exclude_unset=True)))
+
+    # Apply every group in memory before writing any of them
+    valid = all(result is None for result in results)
+    saves = []
+    for method, operations in grouped.items():
+        if not operations:
+            continue
+        applied, method_results, save = preparers[method]([operation for _, operation in operations])
+        valid = valid and applied
+        saves.append((method, save, method_results))
+        for (index, _), result in zip(operations, method_results):
+            results[index] = result
+
+    if not valid:
+        raise HTTPException(status_code=422, detail=results)
+
+    # Then save them one after the other; if a save fails, the databases already saved are
+    # put back as they were, so the batch applies all or nothing
+    saved = []
+    try:
+        for method, save, _ in saves:
+            load, restore = databases[method]
+            original = load()
+            save()
+            saved.append((restore, original))
+    except Exception as e:
+        for restore, original in reversed(saved):
+            restore(original)
+        raise HTTPException(status_code=500, detail=f"batch not applied: {e}")
+
+    for method, _, method_results in saves:
+        broadcaster.publish("credentials", {"method": method, "action": "batch",
+                                            "ids": [result["id"] for result in method_results]})
+    return results
+
+@app.get("/events")
+async def events():
+    """Server-Sent Events stream of credential changes and unlock attempts"""
+    return StreamingResponse(
+        broadcaster.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@app.post("/access_event")
+async def access_event(request: AccessEvent):
+    """Called by the door unlocker to report the outcome of an unlock attempt"""
+    access_log.append(request.method, "unlocked" if request.unlocked else "denied",
+                      request.credential_id, request.latency)
+    broadcaster.publish("access", {"method": request.method, "unlocked": request.unlocked,
+                                   "credential_id": request.credential_id, "latency": request.latency,
+                                   "time": datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')})
+
+def unlock_job_changed(job):
+    broadcaster.publish("unlock_job", job.to_dict())
+
+# Unlock attempts requested over the API rather than by the door's buttons. The door
+# unlocker runs them and reports their outcome to /access_event like any other attempt.
+unlock_jobs = UnlockJobQueue(on_change=unlock_job_changed)
+
+@app.post("/unlock/{method}", status_code=202)
+async def request_unlock(method: str):
+    """Start an unlock attempt in the background and return its job at once"""
+    if method not in METHODS:
+        raise HTTPException(status_code=404, detail=f"unknown method '{method}'")
+    job, deduplicated = unlock_jobs.submit(method)
+    return {**job.to_dict(), "deduplicated": deduplicated}
+
+@app.get("/unlock/{job_id}")
+async def get_unlock_job(job_id: str):
+    job = unlock_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown job '{job_id}'")
+    return job.to_dict()
+
+@app.get("/unlock/{job_id}/events")
+async def unlock_job_events(job_id: str):
+    """Server-Sent Events stream of one job's status, ending with its result"""
+    job = unlock_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown job '{job_id}'")
+    return StreamingResponse(
+        unlock_jobs.stream(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@app.on_event("shutdown")
+async def stop_unlock_jobs():
+    unlock_jobs.cancel_all()
+
+@app.get("/access_log")
+async def get_access_log(start: Optional[str] = None, end: Optional[str] = None,
+                         cursor: Optional[str] = None, limit: int = 100):
+    """Page through unlock attempts between two ISO times, oldest first"""
+    try:
+        start_ts = datetime.datetime.fromisoformat(start).timestamp() if start else None
+        end_ts = datetime.datetime.fromisoformat(end).timestamp() if end else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="start and end must be ISO date-times")
+    if limit < 1:
+        raise HTTPException(status_code=422, detail="limit must be positive")
+
+    try:
+        records, next_cursor = access_log.query(start_ts, end_ts, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"items": records, "next_cursor": next_cursor}
+
+@app.get("/sync/changes")
+async def sync_changes(since: int = 0, log_id: Optional[str] = None,
+                       accept_encoding: Optional[str] = Header(None)):
+    """Credential changes after version since, for lock nodes; deflated if the node accepts it"""
+    delta = credential_log.changes_since(since, log_id or None)
+    body = json.dumps(delta).encode()
+    if accept_encoding and "deflate" in accept_encoding:
+        return Response(zlib.compress(body), media_type="application/json",
+                        headers={"Content-Encoding": "deflate"})
+    return Response(body, media_type="application/json")
+
+@app.post("/sync/consumed")
+async def sync_consumed(request: ConsumedCredential):
+    """Called by a lock node that used up a one-time credential, so the other nodes drop it too"""
+    if request.method not in ("morse", "qr") or not credential_log.consume(request.method, request.id):
+        raise HTTPException(status_code=404, detail=f"unknown {request.method} credential {request.id}")
+    broadcaster.publish("credentials", {"method": request.method, "action": "delete", "ids": [request.id]})
+    return {"version": credential_log.version}
+
+@app.post("/metrics/push")
+async def push_metrics(request: MetricsPush):
+    """Store the cumulative metrics of another process; a newer push replaces the older one"""
+    pushed_metrics[request.source] = request.metrics
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render({"api": metrics.snapshot(), **pushed_metrics})
@@ -0,0 +1,148 @@
+import bisect
+import time
+
+# Upper bounds (seconds) shared by all stage latency histograms
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# Metric children are updated without locks to stay cheap on hot paths. Only a
+# simultaneous update from two threads on the same child can lose a sample,
+# which is acceptable for monitoring.
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def snapshot(self):
+        return {"counts": list(self.counts), "sum": self.sum}
+
+
+class Timer:
+    """Context manager that observes the time spent in its block"""
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    def __init__(self, name, help, kind, label_names=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.children = {}
+        REGISTRY[name] = self
+
+    def labels(self, **labels):
+        """Return the child for these label values; keep it around to skip the lookup on hot paths"""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self.children.get(key)
+        if child is None:
+            child = HistogramChild(self.buckets) if self.kind == "histogram" else CounterChild()
+            self.children[key] = child
+        return child
+
+
+class Counter(Metric):
+    def __init__(self, name, help, label_names=()):
+        super().__init__(name, help, "counter", label_names)
+
+
+class Histogram(Metric):
+    def __init__(self, name, help, label_names=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, "histogram", label_names, buckets)
+
+
+REGISTRY = {}
+
+
+def snapshot():
+    """Return the whole registry as plain data, so another process can expose it"""
+    return {
+        name: {
+            "help": metric.help,
+            "type": metric.kind,
+            "label_names": list(metric.label_names),
+            "buckets": list(metric.buckets),
+            "samples": [[list(key), child.snapshot()] for key, child in list(metric.children.items())],
+        }
+        for name, metric in REGISTRY.items()
+    }
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def render(snapshots):
+    """
+    Render snapshots in the Prometheus text format.
+    snapshots maps a source name, added as the "source" label, to a snapshot() result.
+    """
+    families = {}
+    for source, data in snapshots.items():
+        for name, metric in data.items():
+            families.setdefault(name, (metric, []))[1].append((source, metric))
+
+    lines = []
+    for name, (first, sources) in sorted(families.items()):
+        lines.append(f"# HELP {name} {first['help']}")
+        lines.append(f"# TYPE {name} {first['type']}")
+        for source, metric in sources:
+            for key, value in metric["samples"]:
+                labels = [("source", source)] + list(zip(metric["label_names"], key))
+                if metric["type"] == "counter":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+
+                cumulative = 0
+                bounds = [str(bound) for bound in metric["buckets"]] + ["+Inf"]
+                for bound, count in zip(bounds, value["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared by the unlock flow
+UNLOCK_STAGE_SECONDS = Histogram("unlock_stage_seconds", "Time spent in each stage of an unlock attempt",
+                                 ["stage"])
+UNLOCK_ATTEMPTS = Counter("unlock_attempts_total", "Unlock attempts by method and outcome",
+                          ["method", "outcome"])
+SENSING_JOBS = Counter("sensing_jobs_total", "Sensing jobs run on worker processes by kind and outcome",
+                       ["kind", "outcome"])
+SENSING_WORKER_RESTARTS = Counter("sensing_worker_restarts_total", "Sensing worker processes replaced, by reason",
+                                  ["reason"])
+FRAME_PIPELINE_RESTARTS = Counter("frame_pipeline_restarts_total", "Stalled frame pipeline components restarted",
+                                  ["component"])
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+# Configuration
+PROTOTXT = "MobileNet-SSD/deploy.prototxt"
+CAFFEMODEL = "MobileNet-SSD/mobilenet_iter_73000.caffemodel"
+MIN_CONFIDENCE = 0.5
+
+CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
+           "bottle", "bus", "car", "cat", "chair", "cow", "diningtable",
+           "dog", "horse", "motorbike", "person", "pottedplant", "sheep",
+           "sofa", "train", "tvmonitor"]
+
+# Pre-trained MobileNet SSD, loaded by the first detect_objects() call of the process
+net = None
+
+
+def detect_objects(frame):
+    """Confident detections as [(class index, confidence, (startX, startY, endX, endY) fractions)]"""
+    global net
+    if net is None:
+        net = cv2.dnn.readNetFromCaffe(PROTOTXT, CAFFEMODEL)
+
+    # Convert to blob for DNN; blobFromImage scales the frame itself, so no resized copy is made
+    blob = cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5)
+
+    # Pass blob through network and get detections
+    net.setInput(blob)
+    detections = net.forward()
+
+    # Keep confident detections
+    results = []
+    for i in np.arange(0, detections.shape[2]):
+        confidence = detections[0, 0, i, 2]
+
+        if confidence > MIN_CONFIDENCE:  # Filter weak detections
+            idx = int(detections[0, 0, i, 1])
+            results.append((idx, float(confidence), tuple(float(v) for v in detections[0, 0, i, 3:7])))
+
+    return results
@@ -0,0 +1,218 @@
+import atexit
+import importlib
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+from metrics import SENSING_JOBS, SENSING_WORKER_RESTARTS
+
+# Configuration
+WORKERS = int(os.environ.get("SENSING_WORKERS", 2))
+INPUT_BYTES = 8 * 1024 * 1024  # Shared input buffer per worker: ~47 s of float32 mono audio at 44.1 kHz
+# (a knock attempt sends 13 s, about 2.3 MB) or one 1080p BGR frame (about 6.2 MB)
+START_TIMEOUT = 60.0  # Seconds a new worker may take to import its job modules
+WORKER_NICE = 5  # Workers yield the CPU to the API and serial processes when cores are short
+
+# Job kind -> (function as "module:name", seconds it may run before its worker is killed).
+# The function is called as function(array, **kwargs) and must return something picklable.
+JOBS = {
+    "detect_knocks": ("Knock_pattern.binary_code:detect_knocks", 5.0),
+    "decode_qr": ("QR_code.qr_code_livestream:decode_qr_codes", 2.0),
+    "detect_objects": ("object_detection:detect_objects", 5.0),
+}
+
+
+class SensingError(Exception):
+    """A sensing job failed in its worker"""
+
+
+class SensingTimeout(SensingError):
+    """A sensing job ran past its timeout, or no worker became free in time"""
+
+
+class SensingWorkerCrashed(SensingError):
+    """The worker running a sensing job died"""
+
+
+def load_job(kind):
+    module, name = JOBS[kind][0].split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class Worker:
+    """One worker process, its shared input buffer and the connection jobs go over"""
+
+    def __init__(self, kinds, input_bytes):
+        self.kinds = kinds
+        self.shm = shared_memory.SharedMemory(create=True, size=input_bytes)
+        self.process = None
+        self.start()
+
+    def start(self):
+        # A plain subprocess rather than multiprocessing.Process, so the parent's __main__
+        # (which may own the camera) is not re-imported in the worker
+        parent, child = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(child.fileno()), self.shm.name, ",".join(self.kinds)],
+            pass_fds=(child.fileno(),),
+            # Only the parent writes the trace: a worker inheriting DOOR_LOCK_TRACE would
+            # overwrite the same file with its own spans when it exits
+            env={name: value for name, value in os.environ.items() if name != "DOOR_LOCK_TRACE"})
+        child.close()
+        self.conn = Connection(parent.detach())
+        self.ready = False
+
+    def restart(self, reason):
+        self.process.kill()
+        self.process.wait()
+        self.conn.close()
+        SENSING_WORKER_RESTARTS.labels(reason=reason).inc()
+        print(f"Restarting sensing worker after {reason}")
+        self.start()
+
+    def run(self, kind, array, kwargs, timeout):
+        if self.process.poll() is not None:
+            self.restart("crash")  # Died while idle
+        try:
+            if not self.ready:
+                if not self.conn.poll(START_TIMEOUT):
+                    self.restart("start_timeout")
+                    raise SensingTimeout("sensing worker did not start")
+                self.conn.recv()
+                self.ready = True
+
+            # Copied straight from the caller's array, which need not be contiguous
+            np.copyto(np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf), array)
+            self.conn.send((kind, array.shape, array.dtype.str, kwargs))
+            if not self.conn.poll(timeout):
+                self.restart("timeout")
+                raise SensingTimeout(f"{kind} took longer than {timeout} s")
+            status, result = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.restart("crash")
+            raise SensingWorkerCrashed(f"sensing worker died running {kind}") from e
+        if status == "error":
+            raise SensingError(result)
+        return result
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SensingPool:
+    """
+    A few worker processes for CPU-heavy sensing (knock detection, QR decoding, object
+    detection), so it does not hold the GIL of the process serving the API or the serial
+    port. Each worker has its own shared-memory input buffer: a job's array is copied
+    into it once and only the job kind, shape and result go over the worker's connection.
+    A worker that crashes or runs past its job's timeout is killed and replaced.
+    """
+
+    def __init__(self, workers=WORKERS, input_bytes=INPUT_BYTES):
+        self.size = workers
+        self.input_bytes = input_bytes
+        self.workers = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return bool(self.workers)
+
+    def start(self, kinds=tuple(JOBS)):
+        """Start the workers, importing the modules of these job kinds up front; does nothing if running"""
+        with self.lock:
+            if self.workers:
+                return
+            for _ in range(self.size):
+                worker = Worker(kinds, self.input_bytes)
+                self.workers.append(worker)
+                self.idle.put(worker)
+            atexit.register(self.stop)
+
+    def stop(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.close()
+            self.workers = []
+            self.idle = queue.Queue()
+
+    def submit(self, kind, array, timeout=None, **kwargs):
+        """
+        Run a job on a free worker and return its result, waiting at most timeout seconds
+        (the job's own timeout by default) for the worker. Raises SensingTimeout,
+        SensingWorkerCrashed or SensingError. Runs the job in this process when the pool
+        has not been started, so command-line tools work without workers.
+        """
+        if not self.workers:
+            return load_job(kind)(array, **kwargs)
+        timeout = JOBS[kind][1] if timeout is None else timeout
+        if array.nbytes > self.input_bytes:
+            raise ValueError(f"{kind} input of {array.nbytes} bytes does not fit the {self.input_bytes} byte buffer")
+
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            SENSING_JOBS.labels(kind=kind, outcome="timeout").inc()
+            raise SensingTimeout(f"no sensing worker free for {kind}")
+        try:
+            result = worker.run(kind, array, kwargs, timeout)
+        except SensingTimeout:
+            SENSING_JOBS.labels(kind=kind, outcome="timeout").inc()
+            raise
+        except SensingWorkerCrashed:
+            SENSING_JOBS.labels(kind=kind, outcome="crash").inc()
+            raise
+        except SensingError:
+            SENSING_JOBS.labels(kind=kind, outcome="error").inc()
+            raise
+        finally:
+            self.idle.put(worker)
+        SENSING_JOBS.labels(kind=kind, outcome="ok").inc()
+        return result
+
+
+def worker_main(fd, shm_name, kinds):
+    """Body of a worker process: run each job received on the connection on the shared input"""
+    conn = Connection(fd)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Attaching registers the segment with this process's resource tracker, which would
+    # remove it when the worker is killed; the pool owns it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    os.nice(WORKER_NICE)
+    jobs = {kind: load_job(kind) for kind in kinds if kind}
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            kind, shape, dtype, kwargs = conn.recv()
+        except EOFError:
+            break  # The pool went away
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        try:
+            if kind not in jobs:
+                jobs[kind] = load_job(kind)
+            result = ("ok", jobs[kind](array, **kwargs))
+        except Exception as e:
+            result = ("error", f"{kind} failed: {type(e).__name__}: {e}")
+        del array
+        conn.send(result)
+    shm.close()
+
+
+# The sensing pool of this process, started by whoever runs sensing jobs
+pool = SensingPool()
+
+if __name__ == '__main__':
+    worker_main(int(sys.argv[1]), sys.argv[2], sys.argv[3].split(","))
@@ -0,0 +1,44 @@
+import queue
+import threading
+import time
+
+import serial
+
+
+class SerialReader(threading.Thread):
+    """
+    Reads lines from a serial port on a thread of its own and puts (line, received_at)
+    on a queue for a handler to pick up.
+    readline() blocks in the kernel until data arrives, so the reader wakes as soon as a
+    line is in and uses no CPU while the port is quiet. The port's read timeout only
+    bounds how long stop() takes to be noticed.
+    A final (None, time) on the queue tells the handler the reader has stopped.
+    """
+
+    def __init__(self, ser, lines=None):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.lines = lines if lines is not None else queue.Queue()
+        self.running = True
+
+    def run(self):
+        partial = b''
+        while self.running:
+            try:
+                data = self.ser.readline()
+            except serial.SerialException as e:
+                print(f"Serial read failed: {e}")
+                break
+            if not data:
+                continue
+            partial += data
+            if not partial.endswith(b'\n'):
+                continue  # The timeout cut the line short; the rest follows on the next read
+            line = partial.decode('utf-8', errors='replace').strip()
+            partial = b''
+            if line:
+                self.lines.put((line, time.time()))
+        self.lines.put((None, time.time()))
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,68 @@
+import argparse
+import io
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from camera_capture import FrameOutput, ReplaySource, load_jpeg_frames, synthetic_frames, FRAME_PREFIX, FRAME_SUFFIX
+
+
+def bench_bytesio(frames, duration):
+    """The old capture loop: a new BytesIO per frame, getvalue() and a size-1 queue"""
+    output_queue = queue.Queue(maxsize=1)
+    count = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        for frame in frames:
+            stream = io.BytesIO()
+            stream.write(frame)
+            try:
+                output_queue.get_nowait()
+            except queue.Empty:
+                pass
+            output_queue.put(stream.getvalue())
+            count += 1
+    return count
+
+
+def bench_frame_output(frames, duration):
+    """Continuous recording into FrameOutput, with a reader pulling framed copies"""
+    output = FrameOutput()
+    source = ReplaySource(frames, framerate=0)
+    reads = [0]
+
+    def reader():
+        sequence = 0
+        while source.running:
+            sequence, frame = output.read_frame(sequence, FRAME_PREFIX, FRAME_SUFFIX, timeout=0.5)
+            if frame is not None:
+                reads[0] += 1
+
+    source.start(output)
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    time.sleep(duration)
+    source.stop()
+    thread.join()
+    return output.sequence, reads[0], output.dropped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Capture output throughput benchmark.')
+    parser.add_argument('--frames', help='Directory of JPEGs or MJPEG file (default: synthetic frames)')
+    parser.add_argument('--frame-size', type=int, default=40 * 1024, help='Synthetic frame size in bytes')
+    parser.add_argument('-d', '--duration', type=float, default=5.0, help='Seconds per benchmark')
+    args = parser.parse_args()
+
+    frames = load_jpeg_frames(args.frames) if args.frames else synthetic_frames(frame_bytes=args.frame_size)
+    print(f"{len(frames)} frames, {sum(map(len, frames)) / len(frames) / 1024:.1f} KiB average")
+
+    count = bench_bytesio(frames, args.duration)
+    print(f"BytesIO per frame:  {count / args.duration:10.0f} frames/s")
+
+    written, read, dropped = bench_frame_output(frames, args.duration)
+    print(f"FrameOutput:        {written / args.duration:10.0f} frames/s written, "
+          f"{read / args.duration:.0f} frames/s read, {dropped} dropped")
@@ -0,0 +1,95 @@
+import argparse
+import io
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).parent.parent))
+from camera_capture import RawFrameOutput, RESOLUTION
+
+JPEG_QUALITY = 80
+DETECTIONS = [(15, 0.9, (0.3, 0.2, 0.6, 0.9))]  # One "person" box to draw
+
+
+def draw(frame):
+    (h, w) = frame.shape[:2]
+    for idx, confidence, box in DETECTIONS:
+        (startX, startY, endX, endY) = (np.array(box) * np.array([w, h, w, h])).astype("int")
+        cv2.rectangle(frame, (startX, startY), (endX, endY), (0, 255, 0), 2)
+        cv2.putText(frame, f"person: {confidence*100:.2f}%", (startX, startY - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+
+def old_path(jpg, net):
+    """Camera JPEG -> PIL -> NumPy (RGB) -> detect/draw -> JPEG, as exp_livestream used to do"""
+    frame = np.array(Image.open(io.BytesIO(jpg)))
+    if net is not None:
+        net.setInput(cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 0.007843, (300, 300), 127.5))
+        net.forward()
+    draw(frame)
+    _, buffer = cv2.imencode('.jpg', frame)
+    return buffer.tobytes()
+
+
+def raw_path(raw, output, frame, sequence, net):
+    """Raw BGR into a preallocated ring -> own buffer -> detect/draw -> single JPEG encode"""
+    output.write(raw)
+    sequence = output.read_frame_into(frame, sequence)
+    if net is not None:
+        net.setInput(cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5))
+        net.forward()
+    draw(frame)
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return sequence
+
+
+def measure(name, step, count):
+    step()  # Warm up
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for _ in range(count):
+        step()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:10s} {elapsed / count * 1000:8.2f} ms/frame   peak traced {(peak - before) / 1024:8.1f} KiB"
+          f"   retained {(current - before) / 1024:6.1f} KiB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the old JPEG/PIL frame path with the raw BGR path.')
+    parser.add_argument('-n', '--frames', type=int, default=200, help='Frames per path')
+    parser.add_argument('--image', help='JPEG to use as the camera frame (default: noise)')
+    parser.add_argument('--with-dnn', action='store_true', help='Include MobileNet-SSD inference')
+    args = parser.parse_args()
+
+    width, height = RESOLUTION
+    if args.image:
+        image = cv2.resize(cv2.imread(args.image), (width, height))
+    else:
+        image = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    _, encoded = cv2.imencode('.jpg', image)
+    jpg = encoded.tobytes()
+    raw = image.tobytes()
+
+    net = None
+    if args.with_dnn:
+        net = cv2.dnn.readNetFromCaffe("MobileNet-SSD/deploy.prototxt",
+                                       "MobileNet-SSD/mobilenet_iter_73000.caffemodel")
+
+    output = RawFrameOutput(RESOLUTION)
+    frame = output.new_frame_buffer()
+    state = {"sequence": 0}
+
+    def raw_step():
+        state["sequence"] = raw_path(raw, output, frame, state["sequence"], net)
+
+    measure("jpeg/PIL", lambda: old_path(jpg, net), args.frames)
+    measure("raw BGR", raw_step, args.frames)
@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO = Path(__file__).parent.parent
+sys.path.append(str(REPO))
+# A bus of our own, so a livestream.py running on this machine is never picked up
+os.environ["FRAME_BUS"] = f"bench_qr_{os.getpid()}"
+import QR_code.qr_code_livestream as qr_code_livestream
+from frame_bus import FrameBus
+
+SERVER_OPTIONS = ('source', 'frames', 'fps', 'qr_fraction', 'size', 'angle', 'blur', 'glare', 'seed')
+
+
+def wait_for_server(port, bus_name, timeout=60):
+    """The server renders its frames before listening, which can take a few seconds"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            if bus_name:
+                FrameBus.attach(bus_name).close()
+            return
+        except (OSError, FileNotFoundError):
+            time.sleep(0.2)
+    raise SystemExit("QR stream server did not come up")
+
+
+def start_server(args, password, bus_name):
+    command = [sys.executable, str(REPO / "test" / "qr_stream_server.py"),
+               "--port", str(args.port), "--qr-data", password]
+    for option in SERVER_OPTIONS:
+        value = getattr(args, option)
+        if value is not None:
+            command += [f"--{option.replace('_', '-')}", str(value)]
+    if bus_name:
+        command += ["--frame-bus", bus_name]
+    server = subprocess.Popen(command)
+    wait_for_server(args.port, bus_name)
+    return server
+
+
+def frames_decoded():
+    return sum(qr_code_livestream.PYZBAR_SECONDS.counts)
+
+
+def run_trials(args):
+    """Call one_time_qr_scan() repeatedly; returns (times to a verified code, frames, wall, cpu)"""
+    times = []
+    frames = 0
+    wall = 0.0
+    cpu = 0.0
+    for _ in range(args.trials):
+        # Start at a random point of the replayed loop, as a visitor would
+        time.sleep(random.uniform(0, 0.3))
+        before = frames_decoded()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            verified = qr_code_livestream.one_time_qr_scan(timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+        cpu += time.process_time() - cpu_start
+        wall += elapsed
+        frames += frames_decoded() - before
+        if verified:
+            times.append(elapsed)
+    return times, frames, wall, cpu
+
+
+def report(name, trials, times, frames, wall, cpu):
+    print(f"{name}: {len(times)}/{trials} verified, {frames / wall:6.1f} frames/s decoded, "
+          f"{cpu / max(frames, 1) * 1000:6.2f} ms CPU/frame")
+    if times:
+        p50, p90, p99 = np.percentile(np.array(times) * 1000, [50, 90, 99])
+        print(f"  time to first verified code: p50 {p50:7.1f} ms   p90 {p90:7.1f} ms   p99 {p99:7.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time one_time_qr_scan() against a replayed stream with injected QR codes.')
+    parser.add_argument('-n', '--trials', type=int, default=20, help='Scans per path')
+    parser.add_argument('--timeout', type=float, default=10, help='Timeout of each scan in seconds')
+    parser.add_argument('--path', choices=['http', 'bus', 'both'], default='both',
+                        help='Scan the MJPEG stream over HTTP, the shared-memory frame bus, or both')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--source', help='Directory of JPEGs, MJPEG file or video file (default: noise)')
+    parser.add_argument('--frames', type=int, help='Frames in the replayed loop')
+    parser.add_argument('--fps', type=float, help='Replay rate')
+    parser.add_argument('--qr-fraction', type=float, help='Fraction of frames showing the code')
+    parser.add_argument('--size', help='QR side in pixels, as min:max')
+    parser.add_argument('--angle', help='Rotation in degrees, as min:max')
+    parser.add_argument('--blur', help='Gaussian blur sigma, as min:max')
+    parser.add_argument('--glare', help='Glare spot strength 0-1, as min:max')
+    parser.add_argument('--seed', type=int, help='Seed for the per-frame distortions')
+    args = parser.parse_args()
+    if args.source:
+        args.source = os.path.abspath(args.source)
+
+    # A throwaway QR database holding the one code the server shows
+    os.chdir(tempfile.mkdtemp(prefix="bench_qr_"))
+    password = qr_code_livestream.generate_password()
+    qr_code_livestream.save_database([{
+        "id": 1, "name": "bench", "password": password, "creation_time": "2000-01-01 00:00:00",
+        "expiration_time": None, "deletion_time": None, "is_one_time": False, "qr_code_file": None,
+    }])
+    qr_code_livestream.FASTAPI_STREAM_URL = f"http://127.0.0.1:{args.port}/video_feed"
+
+    paths = ['http', 'bus'] if args.path == 'both' else [args.path]
+    for path in paths:
+        server = start_server(args, password, os.environ["FRAME_BUS"] if path == 'bus' else None)
+        try:
+            report(path, args.trials, *run_trials(args))
+        finally:
+            server.terminate()
+            server.wait()
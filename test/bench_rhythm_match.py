@@ -0,0 +1,46 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from Knock_pattern.rhythm_match import MAX_INTERVALS, MIN_INTERVALS, RhythmBatch, best_match
+
+
+def knocked(rhythm, rng, tempo_spread, jitter, stray):
+    """The gaps of someone knocking the rhythm at their own tempo, with stray knocks either side"""
+    gaps = rhythm * rng.uniform(1 - tempo_spread, 1 + tempo_spread) * rng.normal(1, jitter, len(rhythm))
+    before = rng.uniform(0.3, 3.0, rng.integers(0, stray + 1))
+    after = rng.uniform(0.3, 3.0, rng.integers(0, stray + 1))
+    return np.concatenate((before, np.maximum(gaps, 0.05), after))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rhythm matching latency and accuracy against the number of patterns.')
+    parser.add_argument('--patterns', default='1,10,100,1000,10000', help='Comma-separated pattern counts')
+    parser.add_argument('-n', '--attempts', type=int, default=200, help='Attempts per pattern count')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Relative spread of each knocked gap')
+    parser.add_argument('--tempo', type=float, default=0.3, help='Relative spread of the overall tempo')
+    parser.add_argument('--stray', type=int, default=2, help='Most stray knocks before and after the rhythm')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'patterns':>8} {'p50 ms':>8} {'p95 ms':>8} {'correct':>9} {'rejected':>9}")
+    for count in map(int, args.patterns.split(',')):
+        rhythms = [rng.uniform(0.3, 1.5, rng.integers(MIN_INTERVALS, MAX_INTERVALS + 1)) for _ in range(count)]
+        batch = RhythmBatch(rhythms)
+
+        times, correct, rejected = [], 0, 0
+        for attempt in range(args.attempts):
+            target = attempt % count
+            intervals = knocked(rhythms[target], rng, args.tempo, args.jitter, args.stray)
+            start = time.perf_counter()
+            index, distance = best_match(intervals, batch)
+            times.append(time.perf_counter() - start)
+            correct += index == target
+            rejected += index is None
+
+        ms = lambda q: np.percentile(times, q) * 1000
+        print(f"{count:8d} {ms(50):8.2f} {ms(95):8.2f} {correct:5d}/{args.attempts} {rejected:5d}/{args.attempts}")
@@ -0,0 +1,113 @@
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+from sensing_pool import load_job, pool
+
+SAMPLE_RATE = 44100
+
+
+def knock_audio(seconds=12, knocks=12, seed=0):
+    """Noise with short decaying bursts, like a recording of someone knocking"""
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 0.02, (int(seconds * SAMPLE_RATE), 1)).astype(np.float32)
+    burst = (rng.normal(0, 1, 2000) * np.exp(-np.arange(2000) / 300)).astype(np.float32)
+    for start in np.sort(rng.uniform(0.5, seconds - 0.5, knocks)):
+        index = int(start * SAMPLE_RATE)
+        audio[index:index + len(burst), 0] += burst
+    return audio
+
+
+def qr_frame(resolution=(640, 480), module=6):
+    """A greyscale camera-sized frame with a QR code in the middle"""
+    import qrcode
+    qr = qrcode.QRCode(border=4)
+    qr.add_data("0" * 64)
+    qr.make(fit=True)
+    matrix = np.array(qr.get_matrix(), dtype=np.uint8)
+    code = np.kron(1 - matrix, np.ones((module, module), dtype=np.uint8)) * 255
+    frame = np.full(resolution[::-1], 200, dtype=np.uint8)
+    top, left = (resolution[1] - code.shape[0]) // 2, (resolution[0] - code.shape[1]) // 2
+    frame[top:top + code.shape[0], left:left + code.shape[1]] = code
+    return frame
+
+
+def measure(url, count, interval):
+    """Latencies of count GETs spaced interval apart; runs in its own process"""
+    session = requests.Session()
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        session.get(url).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(interval)
+    return latencies
+
+
+def scan_load(kind, array, use_pool, stop, counter):
+    """What an unlock attempt does to the process: run sensing jobs back to back"""
+    function = load_job(kind)
+    while not stop.is_set():
+        if use_pool:
+            pool.submit(kind, array)
+        else:
+            function(array)
+        counter[0] += 1
+
+
+def start_api(port):
+    import uvicorn
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"time": time.time()}
+
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/ping"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API latency while sensing runs on threads of the API process or on the sensing pool.')
+    parser.add_argument('--job', choices=['detect_knocks', 'decode_qr'], default='detect_knocks')
+    parser.add_argument('--scanners', type=int, default=2, help='Threads submitting sensing jobs')
+    parser.add_argument('-n', '--requests', type=int, default=500, help='API requests per phase')
+    parser.add_argument('--interval', type=float, default=0.005, help='Seconds between API requests')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    array = knock_audio() if args.job == 'detect_knocks' else qr_frame()
+    url = start_api(args.port)
+    pool.start(kinds=(args.job,))
+    pool.submit(args.job, array)  # Wait for the workers to come up
+
+    print(f"{'phase':>12} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'jobs/s':>8}")
+    with ProcessPoolExecutor(1) as client:
+        client.submit(measure, url, 10, 0).result()  # Warm up
+        for phase in ('idle', 'threads', 'pool'):
+            stop, counter = threading.Event(), [0]
+            scanners = [threading.Thread(target=scan_load, args=(args.job, array, phase == 'pool', stop, counter))
+                        for _ in range(args.scanners if phase != 'idle' else 0)]
+            for scanner in scanners:
+                scanner.start()
+            start = time.perf_counter()
+            latencies = np.array(client.submit(measure, url, args.requests, args.interval).result()) * 1000
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for scanner in scanners:
+                scanner.join()
+            print(f"{phase:>12} {np.percentile(latencies, 50):8.2f} {np.percentile(latencies, 99):8.2f} "
+                  f"{latencies.max():8.2f} {counter[0] / elapsed:8.1f}")
+    pool.stop()
@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from Voice_passphrase.voice_passphrase import TemplateBatch, extract_features, identify
+
+SAMPLE_RATE = 44100  # As captured by audio_capture
+
+
+def synthetic_voice(rng):
+    """Parameters of a made-up speaker saying a made-up phrase: pitch and formant tracks"""
+    syllables = rng.integers(3, 6)
+    return {
+        "pitch": rng.uniform(90, 250),
+        "formants": rng.uniform([300, 900, 2200], [900, 2200, 3200], size=(syllables, 3)),
+        "lengths": rng.uniform(0.15, 0.35, syllables),
+    }
+
+
+def utterance(voice, rng, tempo=1.0, noise=0.01):
+    """Render the phrase as a buzz through moving resonances, with silence either side"""
+    pieces = [np.zeros(int(0.3 * SAMPLE_RATE))]
+    for formants, length in zip(voice["formants"], voice["lengths"] * tempo):
+        t = np.arange(int(length * SAMPLE_RATE)) / SAMPLE_RATE
+        pitch = voice["pitch"] * (1 + 0.05 * np.sin(2 * np.pi * 3 * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        harmonics = np.arange(1, 30)[:, None]
+        # Each harmonic is weighted by how close it lies to the syllable's formants
+        frequencies = harmonics * pitch[None, :]
+        weights = sum(np.exp(-((frequencies - f) / 150) ** 2) for f in formants)
+        piece = (weights * np.sin(harmonics * phase[None, :])).sum(axis=0)
+        pieces.append(piece * np.hanning(len(piece)))
+    pieces.append(np.zeros(int(0.3 * SAMPLE_RATE)))
+    signal = np.concatenate(pieces)
+    signal = signal / np.abs(signal).max() * 0.5
+    return (signal + rng.normal(0, noise, len(signal))).astype(np.float32)
+
+
+def enroll(voices, templates_per_user, rng):
+    templates, owners = [], []
+    for user_id, voice in enumerate(voices, start=1):
+        for _ in range(templates_per_user):
+            templates.append(extract_features(utterance(voice, rng, tempo=rng.uniform(0.9, 1.1)), SAMPLE_RATE))
+            owners.append(user_id)
+    return TemplateBatch(templates, owners)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Voice unlock latency against the number of enrolled users.')
+    parser.add_argument('--users', default='1,5,10,25,50,100,200', help='Comma-separated user counts')
+    parser.add_argument('--templates', type=int, default=3, help='Templates enrolled per user')
+    parser.add_argument('-n', '--attempts', type=int, default=20, help='Attempts per user count')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'users':>6} {'templates':>9} {'features ms':>12} {'match p50 ms':>13} {'match p95 ms':>13} "
+          f"{'total p95 ms':>13} {'correct':>8}")
+    for users in map(int, args.users.split(',')):
+        voices = [synthetic_voice(rng) for _ in range(users)]
+        batch = enroll(voices, args.templates, rng)
+
+        feature_times, match_times, totals, correct = [], [], [], 0
+        for attempt in range(args.attempts):
+            speaker = attempt % users
+            audio = utterance(voices[speaker], rng, tempo=rng.uniform(0.85, 1.15), noise=0.02)
+            start = time.perf_counter()
+            features = extract_features(audio, SAMPLE_RATE)
+            extracted = time.perf_counter()
+            user_id, distance = identify(features, batch, threshold=np.inf)
+            done = time.perf_counter()
+            feature_times.append(extracted - start)
+            match_times.append(done - extracted)
+            totals.append(done - start)
+            correct += user_id == speaker + 1
+
+        ms = lambda values, q: np.percentile(values, q) * 1000
+        print(f"{users:6d} {len(batch):9d} {ms(feature_times, 50):12.1f} {ms(match_times, 50):13.1f} "
+              f"{ms(match_times, 95):13.1f} {ms(totals, 95):13.1f} {correct:5d}/{args.attempts}")
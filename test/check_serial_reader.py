@@ -0,0 +1,95 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import serial
+
+sys.path.append(str(Path(__file__).parent.parent))
+from serial_reader import SerialReader
+
+
+def open_pty():
+    """A pseudo-terminal pair: we write to the master fd, the code under test opens the slave"""
+    master, slave = os.openpty()
+    return master, serial.Serial(os.ttyname(slave), 9600, timeout=1)
+
+
+def cpu_while(seconds, work=None):
+    """Fraction of one core this process uses over seconds, running work() or sleeping"""
+    cpu_start = time.process_time()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if work is None:
+            time.sleep(end - time.perf_counter())
+        else:
+            work()
+    return (time.process_time() - cpu_start) / seconds
+
+
+def check_busy_poll(idle):
+    """The old monitor loop, polling in_waiting with no sleep, for comparison"""
+    master, ser = open_pty()
+    usage = cpu_while(idle, lambda: ser.in_waiting > 0)
+    ser.close()
+    os.close(master)
+    return usage
+
+
+def check_reader(idle, lines):
+    master, ser = open_pty()
+    reader = SerialReader(ser)
+    reader.start()
+    time.sleep(0.1)
+
+    usage = cpu_while(idle)
+
+    latencies = []
+    for i in range(lines):
+        start = time.perf_counter()
+        os.write(master, b"UNLOCK_BY_QR_CODE\r\n")
+        line, _ = reader.lines.get(timeout=2)
+        latencies.append(time.perf_counter() - start)
+        assert line == "UNLOCK_BY_QR_CODE", line
+        time.sleep(0.02)
+
+    # A line split across the reader's timeout still arrives whole
+    os.write(master, b"UNLOCK_BY_")
+    time.sleep(1.2)
+    os.write(master, b"PATTERN\n")
+    line, _ = reader.lines.get(timeout=2)
+    assert line == "UNLOCK_BY_PATTERN", line
+
+    reader.stop()
+    reader.join(timeout=2)
+    ser.close()
+    os.close(master)
+    return usage, latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check that SerialReader wakes at once on input and idles without CPU, on a pty.')
+    parser.add_argument('--idle', type=float, default=3.0, help='Seconds to measure idle CPU over')
+    parser.add_argument('--lines', type=int, default=50, help='Lines to time')
+    parser.add_argument('--max-idle-cpu', type=float, default=0.02, help='Allowed idle CPU, fraction of a core')
+    parser.add_argument('--max-latency', type=float, default=0.02, help='Allowed worst-case wake-up in seconds')
+    args = parser.parse_args()
+
+    print(f"busy in_waiting poll: {check_busy_poll(args.idle) * 100:5.1f}% of a core while idle")
+    usage, latencies = check_reader(args.idle, args.lines)
+    print(f"SerialReader:         {usage * 100:5.1f}% of a core while idle")
+    print(f"wake-up latency: median {statistics.median(latencies) * 1000:.2f} ms, "
+          f"max {max(latencies) * 1000:.2f} ms over {len(latencies)} lines")
+
+    failed = False
+    if usage > args.max_idle_cpu:
+        print(f"FAIL: idle CPU above {args.max_idle_cpu * 100:.1f}%")
+        failed = True
+    if max(latencies) > args.max_latency:
+        print(f"FAIL: wake-up slower than {args.max_latency * 1000:.0f} ms")
+        failed = True
+    print("FAIL" if failed else "OK")
+    sys.exit(1 if failed else 0)
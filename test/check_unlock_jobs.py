@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import serial
+
+sys.path.append(str(Path(__file__).parent.parent))
+from unlock_jobs import UnlockJobQueue
+from unlock_orchestrator import UnlockOrchestrator
+
+LINES = {"qr": "UNLOCK_BY_QR_CODE", "morse": "UNLOCK_BY_PATTERN", "voice": "UNLOCK_BY_VOICE"}
+
+
+class FakeSensing:
+    """Sensing functions that take a while and record how many attempts run at once"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+        self.calls = 0
+
+    def function(self, method):
+        def sense(stop_event):
+            with self.lock:
+                self.calls += 1
+                self.running += 1
+                self.most = max(self.most, self.running)
+            stop_event.wait(self.seconds)
+            with self.lock:
+                self.running -= 1
+            return method != "voice", 7
+        return sense
+
+
+class FakeDoor:
+    """The door unlocker's orchestrator on a pty, with this thread playing the Arduino"""
+
+    def __init__(self, sensing, socket_path):
+        self.master, slave = os.openpty()
+        self.ser = serial.Serial(os.ttyname(slave), 9600, timeout=1)
+        self.commands = []
+        self.orchestrator = UnlockOrchestrator(
+            self.ser, {line: (method, sensing.function(method)) for method, line in LINES.items()},
+            socket_path=socket_path)
+        threading.Thread(target=asyncio.run, args=(self.orchestrator.run(),), daemon=True).start()
+        threading.Thread(target=self.arduino, daemon=True).start()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+
+    def arduino(self):
+        pending = b""
+        while True:
+            pending += os.read(self.master, 1024)
+            while b"\n" in pending:
+                line, pending = pending.split(b"\n", 1)
+                command = line.decode().strip()
+                self.commands.append(command)
+                os.write(self.master, (b"DOOR_OPENED" if command == "OPEN_DOOR" else b"ERROR") + b"\r\n")
+
+    def press(self, method):
+        os.write(self.master, LINES[method].encode() + b"\r\n")
+
+
+async def wait_done(jobs):
+    while not all(job.done for job in jobs):
+        await asyncio.sleep(0.01)
+
+
+async def check_dedup(socket_path, sensing, door):
+    queue = UnlockJobQueue(socket_path)
+    first, deduplicated_first = queue.submit("qr")
+    second, deduplicated_second = queue.submit("qr")
+    assert second is first and not deduplicated_first and deduplicated_second
+    await wait_done([first])
+    assert sensing.calls == 1, sensing.calls
+    assert first.status == "unlocked" and first.credential_id == 7, first.to_dict()
+    assert door.commands == ["OPEN_DOOR"], door.commands
+    third, deduplicated = queue.submit("qr")  # The first one is finished, so this is new
+    assert third is not first and not deduplicated
+    await wait_done([third])
+
+
+async def check_one_at_a_time(socket_path, sensing, door):
+    """Remote attempts for different methods wait for each other instead of cancelling"""
+    queue = UnlockJobQueue(socket_path)
+    commands = len(door.commands)
+    start = time.perf_counter()
+    jobs = [queue.submit(method)[0] for method in ("morse", "voice", "qr")]
+    await wait_done(jobs)
+    elapsed = time.perf_counter() - start
+    assert [job.status for job in jobs] == ["unlocked", "denied", "unlocked"], [job.to_dict() for job in jobs]
+    assert sensing.most == 1, sensing.most
+    assert elapsed >= 3 * sensing.seconds, elapsed
+    assert sorted(door.commands[commands:]) == ["ERROR", "OPEN_DOOR", "OPEN_DOOR"], door.commands
+    return elapsed
+
+
+async def check_button_cancels(socket_path, sensing, door):
+    """Someone at the door pressing another button cancels a remote attempt"""
+    queue = UnlockJobQueue(socket_path)
+    job, _ = queue.submit("voice")
+    while job.status != "running":
+        await asyncio.sleep(0.01)
+    door.press("qr")
+    await wait_done([job])
+    assert job.status == "failed" and "cancelled" in job.error, job.to_dict()
+    while door.orchestrator.attempt.running():  # Let the button's attempt finish
+        await asyncio.sleep(0.01)
+
+
+async def check_unreachable():
+    queue = UnlockJobQueue(os.path.join(tempfile.mkdtemp(), "missing.sock"))
+    job, _ = queue.submit("qr")
+    await wait_done([job])
+    assert job.status == "failed" and "not reachable" in job.error, job.to_dict()
+
+
+async def check_stream(socket_path, seconds):
+    """A consumer slower than the job still gets every state up to the result"""
+    queue = UnlockJobQueue(socket_path)
+    job, _ = queue.submit("morse")
+    statuses = []
+    async for event in queue.stream(job):
+        if event.startswith("event: unlock_job"):
+            statuses.append(json.loads(event.split("data: ", 1)[1])["status"])
+        await asyncio.sleep(seconds * 2)  # The job finishes while this event is being sent
+    assert statuses[0] == "queued" and statuses[-1] == "unlocked", statuses
+    return statuses
+
+
+async def main(seconds):
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="check_unlock_jobs_"), "door_unlocker.sock")
+    sensing = FakeSensing(seconds)
+    door = FakeDoor(sensing, socket_path)
+
+    await check_dedup(socket_path, sensing, door)
+    print("dedup: a second request while queued or running returns the same job; the door opened once")
+    elapsed = await check_one_at_a_time(socket_path, sensing, door)
+    print(f"one at a time: knock, voice and QR took {elapsed:.2f} s for {seconds:.2f} s each, none cancelled")
+    await check_button_cancels(socket_path, sensing, door)
+    print("button press: cancels a remote attempt for another method")
+    await check_unreachable()
+    print("no door unlocker: the job fails instead of hanging")
+    statuses = await check_stream(socket_path, seconds)
+    print(f"stream with a slow consumer: {' -> '.join(statuses)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check deduplication, the hand-over to the door unlocker and the event stream of UnlockJobQueue.')
+    parser.add_argument('--seconds', type=float, default=0.3, help='Seconds each fake sensing function takes')
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds))
+    print("OK")
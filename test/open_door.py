@@ -1,54 +1,98 @@
+import asyncio
 import serial
 import time
+import threading
+import requests
 from pathlib import Path
 import sys
 
 # Add QR code module to path
 sys.path.append(str(Path(__file__).parent.parent))
+import QR_code.qr_code_livestream as qr_code_livestream
+import Knock_pattern.binary_code as binary_code
 from QR_code.qr_code_livestream import one_time_qr_scan
 from Knock_pattern.binary_code import start_recording_knocks
+import Voice_passphrase.voice_passphrase as voice_passphrase
+from unlock_orchestrator import UnlockOrchestrator
+import audio_capture
+import credential_sync
+from sensing_pool import pool
+import metrics
+from metrics import UNLOCK_ATTEMPTS
+import tracing
+
+ACCESS_EVENT_URL = "http://localhost:8000/access_event"  # Broadcast to dashboards by main.py
+METRICS_PUSH_URL = "http://localhost:8000/metrics/push"  # Exposed by main.py at /metrics
+CLIP_URL = "http://localhost:8080/clip"  # livestream.py saves footage around each attempt
 
 class DoorUnlocker:
     def __init__(self, port='/dev/ttyACM0', baudrate=9600):
         self.ser = serial.Serial(port, baudrate, timeout=1)
         time.sleep(2)  # Wait for Arduino to reset
         self.ser.reset_input_buffer()
-        
-    def send_open_door(self):
-        """Send command to open the door"""
-        self.ser.write(b"OPEN_DOOR\n")
-        time.sleep(1.5)  # Wait for door to open
-        
-    def send_error(self):
-        """Send error signal"""
-        self.ser.write(b"ERROR\n")
-        time.sleep(2)  # Wait for buzzer to finish playing
-        
+        # Keep the microphone open from the start, so the first knock attempt has pre-roll too
+        audio_capture.capture.start()
+        # Knock and QR analysis run on worker processes, so the serial port is never starved
+        pool.start(kinds=("detect_knocks", "decode_qr"))
+        self.orchestrator = UnlockOrchestrator(self.ser, {
+            "UNLOCK_BY_QR_CODE": ("qr", self.scan_qr_code),
+            "UNLOCK_BY_PATTERN": ("morse", self.listen_for_knocks),
+            "UNLOCK_BY_VOICE": ("voice", self.recognise_voice),
+        }, on_result=self.report_access)
+        # On a lock node, pull credential changes from the central server in the background
+        self.sync = None
+        if credential_sync.SYNC_SERVER:
+            self.sync = credential_sync.SyncClient()
+            self.sync.start()
+
+    def report_access(self, method, unlocked, started, credential_id=None):
+        """Report an unlock outcome to the API in the background so it never delays the door"""
+        event = {"method": method, "unlocked": unlocked, "latency": time.time() - started,
+                 "credential_id": credential_id if unlocked else None}
+        UNLOCK_ATTEMPTS.labels(method=method, outcome="unlocked" if unlocked else "denied").inc()
+        snapshot = metrics.snapshot()
+
+        def post():
+            # A one-time credential used up here must not open the other doors syncing from the server
+            if self.sync is not None and unlocked:
+                self.sync.record_use(method, credential_id)
+            # Each report on its own, so livestream.py being down does not lose the access log entry
+            reports = [
+                ("clip", CLIP_URL, {"reason": f"{method}_{'unlocked' if unlocked else 'denied'}"}),
+                ("access event", ACCESS_EVENT_URL, event),
+                ("metrics", METRICS_PUSH_URL, {"source": "door_unlocker", "metrics": snapshot}),
+            ]
+            for name, url, body in reports:
+                try:
+                    requests.post(url, json=body, timeout=2)
+                except requests.RequestException as e:
+                    print(f"Could not report {name}: {e}")
+
+        threading.Thread(target=post, daemon=True).start()
+
+    # Sensing functions, run by the orchestrator on a worker thread for button presses and
+    # for remote attempts requested by main.py alike. Each gets an event that is set when
+    # the attempt is cancelled, and returns (unlocked, credential id).
+
+    def scan_qr_code(self, stop_event):
+        with tracing.span("one_time_qr_scan"):
+            unlocked = one_time_qr_scan(stop_event=stop_event)
+        return unlocked, qr_code_livestream.matched_id
+
+    def listen_for_knocks(self, stop_event):
+        with tracing.span("start_recording_knocks"):
+            unlocked = start_recording_knocks(stop_event=stop_event)
+        return unlocked, binary_code.matched_id
+
+    def recognise_voice(self, stop_event):
+        with tracing.span("start_voice_unlock"):
+            unlocked = voice_passphrase.start_voice_unlock(stop_event=stop_event)
+        return unlocked, voice_passphrase.matched_id
+
     def monitor_unlock_requests(self):
-        """Monitor serial port for unlock requests"""
+        """Serve unlock requests from the serial port until interrupted"""
         try:
-            while True:
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8').strip()
-                    
-                    if line == "UNLOCK_BY_QR_CODE":
-                        print("QR Code unlock requested")
-                        if one_time_qr_scan():
-                            self.send_open_door()
-                        else:
-                            self.send_error()
-                            
-                    elif line == "UNLOCK_BY_PATTERN":
-                        print("Pattern unlock requested")
-                        if start_recording_knocks():
-                            self.send_open_door()
-                        
-                    elif line == "UNLOCK_BY_VOICE":
-                        print("Voice unlock requested")
-                        # Add your voice recognition logic here
-                        # For now, we'll just open the door
-                        self.send_open_door()
-                        
+            asyncio.run(self.orchestrator.run())
         except KeyboardInterrupt:
             print("\nStopping monitor...")
         finally:
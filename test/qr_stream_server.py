@@ -0,0 +1,163 @@
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import qrcode
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+sys.path.append(str(Path(__file__).parent.parent))
+from camera_capture import FrameOutput, FrameBroadcaster, ReplaySource, load_jpeg_frames, RESOLUTION
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.h264')
+
+
+def parse_range(text):
+    """'a:b' -> (a, b); a single number is a fixed value"""
+    low, _, high = text.partition(':')
+    return float(low), float(high or low)
+
+
+def load_background(source, count):
+    """Up to count BGR frames at RESOLUTION from a directory of JPEGs, an MJPEG or video file, or noise"""
+    width, height = RESOLUTION
+    images = []
+    if source is None:
+        rng = np.random.default_rng(0)
+        gradient = np.linspace(60, 190, width, dtype=np.float32)[None, :, None]
+        for _ in range(count):
+            noise = rng.normal(0, 12, (height, width, 3))
+            images.append(np.clip(gradient + noise, 0, 255).astype(np.uint8))
+    elif source.lower().endswith(VIDEO_EXTENSIONS):
+        capture = cv2.VideoCapture(source)
+        while len(images) < count:
+            ok, image = capture.read()
+            if not ok:
+                break
+            images.append(image)
+        capture.release()
+    else:
+        for jpg in load_jpeg_frames(source)[:count]:
+            image = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                images.append(image)
+    if not images:
+        raise SystemExit(f"No frames could be read from {source}")
+    return [cv2.resize(image, (width, height)) for image in images]
+
+
+def qr_image(data):
+    """The QR code as generate_qr_code() draws it, as a greyscale array with one pixel per module"""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=1, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return np.where(np.array(qr.get_matrix()), 0, 255).astype(np.uint8)
+
+
+def inject_qr(frame, code, size, angle, blur, glare, rng):
+    """Paste the QR code into frame at a random position, rotated, blurred and with a glare spot"""
+    (h, w) = frame.shape[:2]
+    size = int(size)
+    qr = cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+
+    # Rotate on a canvas big enough for any angle, along with a mask of where the code is
+    side = int(np.ceil(size * np.sqrt(2)))
+    matrix = cv2.getRotationMatrix2D((size / 2, size / 2), angle, 1.0)
+    matrix[:, 2] += (side - size) / 2
+    patch = cv2.warpAffine(qr, matrix, (side, side), flags=cv2.INTER_LINEAR, borderValue=255)
+    mask = cv2.warpAffine(np.full_like(qr, 255), matrix, (side, side), flags=cv2.INTER_LINEAR)
+
+    side = min(side, w, h)
+    patch = patch[:side, :side].astype(np.float32)
+    mask = mask[:side, :side].astype(np.float32) / 255
+    if blur > 0:
+        # Blurring the mask too softens the code's edge into the background, as out of focus
+        patch = cv2.GaussianBlur(patch, (0, 0), blur)
+        mask = cv2.GaussianBlur(mask, (0, 0), blur)
+    if glare > 0:
+        # A soft white spot somewhere on the code, as from a lamp on a phone screen
+        yy, xx = np.mgrid[0:side, 0:side].astype(np.float32)
+        cx, cy = rng.uniform(0, side, 2)
+        radius = side / 4
+        patch += glare * 255 * np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radius ** 2))
+
+    x = int(rng.integers(0, w - side + 1))
+    y = int(rng.integers(0, h - side + 1))
+    region = frame[y:y + side, x:x + side].astype(np.float32)
+    region = region * (1 - mask[:, :, None]) + np.minimum(patch, 255)[:, :, None] * mask[:, :, None]
+    frame[y:y + side, x:x + side] = region.astype(np.uint8)
+    return frame
+
+
+def build_frames(args):
+    """Render the replayed clip once up front, so serving it costs no CPU per frame"""
+    rng = np.random.default_rng(args.seed)
+    backgrounds = load_background(args.source, args.frames)
+    code = qr_image(args.qr_data) if args.qr_data else None
+    sizes, angles, blurs, glares = (parse_range(r) for r in (args.size, args.angle, args.blur, args.glare))
+
+    frames = []
+    for i in range(args.frames):
+        frame = backgrounds[i % len(backgrounds)].copy()
+        if code is not None and rng.random() < args.qr_fraction:
+            inject_qr(frame, code, rng.uniform(*sizes), rng.uniform(*angles),
+                      rng.uniform(*blurs), rng.uniform(*glares), rng)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, args.quality])
+        frames.append(buffer.tobytes())
+    return frames
+
+
+def create_app(frames, fps, bus_name=None):
+    """Serve frames like livestream.py does, optionally publishing them on a frame bus too"""
+    app = FastAPI()
+    output = FrameOutput()
+    broadcaster = FrameBroadcaster(output)
+    source = ReplaySource(frames, framerate=fps)
+    source.start(output)
+    if bus_name:
+        from frame_bus import FrameBus
+        bus = FrameBus.create(bus_name)
+        source.start(bus, format='bgr')
+        app.router.on_shutdown.append(bus.close)
+    app.router.on_shutdown.append(source.stop)
+
+    @app.get('/video_feed')
+    async def video_feed():
+        return StreamingResponse(
+            broadcaster.frames(),
+            media_type='multipart/x-mixed-replace; boundary=frame'
+        )
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Stand-in for livestream.py that replays frames with injected QR codes.')
+    parser.add_argument('--source', help='Directory of JPEGs, MJPEG file or video file (default: noise)')
+    parser.add_argument('--frames', type=int, default=90, help='Frames in the replayed loop')
+    parser.add_argument('--fps', type=float, default=30, help='Replay rate')
+    parser.add_argument('--quality', type=int, default=85, help='JPEG quality of the replayed frames')
+    parser.add_argument('--qr-data', help='Text to encode in the injected QR code (default: no code)')
+    parser.add_argument('--qr-fraction', type=float, default=1.0, help='Fraction of frames showing the code')
+    parser.add_argument('--size', default='120:240', help='QR side in pixels, as min:max')
+    parser.add_argument('--angle', default='-30:30', help='Rotation in degrees, as min:max')
+    parser.add_argument('--blur', default='0:1.5', help='Gaussian blur sigma, as min:max')
+    parser.add_argument('--glare', default='0:0.5', help='Glare spot strength 0-1, as min:max')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the per-frame distortions')
+    parser.add_argument('--frame-bus', help='Also publish raw frames on the frame bus with this name')
+    parser.add_argument('--save', help='Write the rendered loop to this MJPEG file and exit')
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    frames = build_frames(args)
+    if args.save:
+        with open(args.save, 'wb') as f:
+            f.write(b''.join(frames))
+        sys.exit(0)
+
+    import uvicorn
+    uvicorn.run(create_app(frames, args.fps, args.frame_bus), host='127.0.0.1', port=args.port,
+                log_level='warning')
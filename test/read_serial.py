@@ -5,8 +5,9 @@ ser = serial.Serial('/dev/ttyACM0', 9600, timeout=1)
 
 try:
     while True:
-        if ser.in_waiting > 0:
-            line = ser.readline().decode('utf-8').strip()
+        # Blocks until a line arrives (or the 1 s timeout passes) instead of spinning
+        line = ser.readline().decode('utf-8').strip()
+        if line:
             print("Arduino says:", line)
 except KeyboardInterrupt:
     ser.close()
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).parent.parent
+sys.path.append(str(ROOT))
+
+
+def seed_entries(count):
+    return [{"id": id, "name": f"user {id}", "password": format(id, "b"), "knock_password": format(id, "b"),
+             "type": None, "creation_time": "2024-01-01T00:00", "expiration_time": None, "deletion_time": None}
+            for id in range(1, count + 1)]
+
+
+def read_entries(directory):
+    """Knock entries of a server or node directory by id, or None while it has none"""
+    path = Path(directory) / "binary_password.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return {entry["id"]: entry for entry in json.load(f)}
+
+
+def wait_for_sync(server_dir, node_dirs, timeout):
+    """Seconds until every node holds the server's entries"""
+    start = time.perf_counter()
+    expected = read_entries(server_dir)
+    while time.perf_counter() - start < timeout:
+        if all(read_entries(node) == expected for node in node_dirs):
+            return time.perf_counter() - start
+        time.sleep(0.02)
+    raise TimeoutError("nodes did not converge")
+
+
+def wire_bytes(url, since, log_id):
+    """Compressed and uncompressed size of the delta a node at version since would get"""
+    params = {"since": since, "log_id": log_id}
+    deflated = requests.get(f"{url}/sync/changes", params=params, headers={"Accept-Encoding": "deflate"},
+                            stream=True).raw.read()
+    plain = requests.get(f"{url}/sync/changes", params=params, headers={"Accept-Encoding": "identity"}).content
+    return len(deflated), len(plain)
+
+
+def node_state(directory):
+    with open(Path(directory) / "credential_sync.json") as f:
+        return json.load(f)
+
+
+def start_server(directory, port):
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                               "--app-dir", str(ROOT), "--log-level", "warning"], cwd=directory)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(f"{url}/sync/changes", timeout=1)
+            return server, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def check_consumption(url, server_dir, node_dirs, door_dir, id):
+    """
+    A knock used up at one door is deleted on the server and every other node, and a
+    snapshot pulled before the use was reported does not bring it back at that door.
+    Runs the door in this process, as the door unlocker would.
+    """
+    os.chdir(door_dir)  # The databases are relative paths
+    import credential_sync
+    from Knock_pattern import binary_code
+
+    client = credential_sync.SyncClient(url)
+    client.pull()
+    binary_code.delete_binary_password(id)  # What a successful knock attempt does
+    client.record_use("morse", id)
+    client.log_id = None  # The next pull is a snapshot, with the use still unreported
+    client.pull()
+    assert read_entries(door_dir)[id]["deletion_time"] is not None, "a snapshot revived a used credential"
+    assert client.push() == 1 and not client.consumed
+    assert read_entries(server_dir)[id]["deletion_time"] is not None
+    seconds = wait_for_sync(server_dir, node_dirs, 30)
+    client.pull()
+    assert read_entries(door_dir) == read_entries(server_dir)
+    return seconds
+
+
+def edit_operations(rng_seed, count, total):
+    ids = [(rng_seed * 7919 + k * 104729) % total + 1 for k in range(count)]
+    return [{"op": "edit", "method": "morse", "id": id, "name": f"user {id} v{rng_seed}", "type": None,
+             "expiration_time": None, "knock_password": format(id, "b"), "password": format(id, "b")}
+            for id in dict.fromkeys(ids)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a credential server and several lock nodes locally and check they stay in sync.')
+    parser.add_argument('--nodes', type=int, default=4, help='Lock node processes')
+    parser.add_argument('--entries', type=int, default=5000, help='Knock passwords on the server')
+    parser.add_argument('--changes', type=int, default=10, help='Entries edited per round')
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds of edits')
+    parser.add_argument('--interval', type=float, default=0.2, help='Seconds between node pulls')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp(prefix="credential_sync_"))
+    server_dir = base / "server"
+    node_dirs = [base / f"node{k}" for k in range(args.nodes)]
+    for directory in [server_dir, *node_dirs]:
+        directory.mkdir()
+    with open(server_dir / "binary_password.json", "w") as f:
+        json.dump(seed_entries(args.entries), f)
+
+    server, url = start_server(server_dir, args.port)
+    env = dict(os.environ, CREDENTIAL_SERVER=url)
+    nodes = [subprocess.Popen([sys.executable, str(ROOT / "credential_sync.py"), "--interval", str(args.interval)],
+                              cwd=directory, env=env, stdout=subprocess.DEVNULL) for directory in node_dirs]
+    try:
+        print(f"{args.nodes} nodes, {args.entries} entries, state in {base}")
+        print(f"initial snapshot: synced in {wait_for_sync(server_dir, node_dirs, 60):.2f} s")
+        compressed, plain = wire_bytes(url, 0, "")
+        print(f"snapshot size: {compressed} bytes deflated, {plain} bytes plain")
+
+        for round in range(1, args.rounds + 1):
+            state = node_state(node_dirs[0])
+            operations = edit_operations(round, args.changes, args.entries)
+            requests.post(f"{url}/batch", json={"operations": operations}).raise_for_status()
+            seconds = wait_for_sync(server_dir, node_dirs, 30)
+            compressed, plain = wire_bytes(url, state["version"], state["log_id"])
+            print(f"round {round}: {len(operations)} edits synced in {seconds:.2f} s, "
+                  f"delta {compressed} bytes deflated, {plain} bytes plain")
+
+        door_dir = base / "door"
+        door_dir.mkdir()
+        seconds = check_consumption(url, server_dir, node_dirs, door_dir, args.entries // 2)
+        print(f"knock used up at one door: deleted on every node in {seconds:.2f} s")
+
+        # Nodes keep their credentials while the server is down and catch up once it is back
+        server.terminate()
+        server.wait()
+        time.sleep(3 * args.interval)
+        assert all(node.poll() is None for node in nodes), "a node exited while the server was down"
+        assert all(read_entries(node) is not None for node in node_dirs)
+        entries = list(read_entries(server_dir).values())
+        entries[0]["name"] = "edited while nodes were offline"
+        with open(server_dir / "binary_password.json", "w") as f:
+            json.dump(entries, f)
+        server, url = start_server(server_dir, args.port)
+        print(f"server restarted: caught up in {wait_for_sync(server_dir, node_dirs, 60):.2f} s")
+    finally:
+        server.terminate()
+        for node in nodes:
+            node.terminate()
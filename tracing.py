@@ -0,0 +1,91 @@
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+
+# Set DOOR_LOCK_TRACE=<file.json> to record spans and write them out as a Chrome trace on exit.
+# The file can be opened in Perfetto (ui.perfetto.dev) or chrome://tracing.
+TRACE_FILE = os.environ.get("DOOR_LOCK_TRACE")
+BUFFER_SIZE = 100000  # Spans kept per thread; the oldest are dropped first
+
+enabled = False
+local = threading.local()
+buffers = []  # (thread id, thread name, deque of spans), kept after the thread exits
+buffers_lock = threading.Lock()  # Only taken the first time a thread records a span
+
+
+class Span:
+    """Context manager recording one complete event on the calling thread's buffer"""
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        buffer = getattr(local, "buffer", None)
+        if buffer is None:
+            buffer = thread_buffer()
+        # deque.append is atomic, so recording never takes a lock
+        buffer.append((self.name, self.start, end, self.args))
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def thread_buffer():
+    thread = threading.current_thread()
+    local.buffer = collections.deque(maxlen=BUFFER_SIZE)
+    with buffers_lock:
+        buffers.append((threading.get_native_id(), thread.name, local.buffer))
+    return local.buffer
+
+
+def span(name, **args):
+    """Time a block as a trace span; costs a single check when tracing is off"""
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def dump(path):
+    """Write every recorded span as Chrome trace-event JSON"""
+    pid = os.getpid()
+    events = []
+    with buffers_lock:
+        threads = list(buffers)
+
+    for tid, thread_name, buffer in threads:
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": thread_name}})
+        # deque.copy() runs without releasing the GIL, so it is safe while the thread keeps appending
+        for name, start, end, args in buffer.copy():
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": start / 1000, "dur": (end - start) / 1000, "args": args})
+
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+if TRACE_FILE:
+    enable()
+    atexit.register(dump, TRACE_FILE)
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import secrets
+import time
+from collections import OrderedDict
+
+from unlock_orchestrator import UNLOCK_SOCKET
+
+# Configuration
+METHODS = ("qr", "morse", "voice")
+JOB_HISTORY = 256  # Jobs kept for GET /unlock/{job_id}; the oldest finished ones go first
+KEEPALIVE_INTERVAL = 15  # Seconds between keep-alive comments on an idle job stream
+
+FINISHED = ("unlocked", "denied", "failed")
+
+
+class UnlockJob:
+    def __init__(self, method):
+        self.id = secrets.token_hex(8)
+        self.method = method
+        self.status = "queued"
+        self.credential_id = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+        self.changed = asyncio.Event()  # Replaced after every change, so waiters see the next one
+
+    def update(self, status, **fields):
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def to_dict(self):
+        return {"job_id": self.id, "method": self.method, "status": self.status,
+                "credential_id": self.credential_id, "error": self.error, "created": self.created,
+                "started": self.started, "finished": self.finished}
+
+
+class UnlockJobQueue:
+    """
+    Unlock attempts requested over the API, run in the background so the request returns
+    a job id at once. A request for a method that already has a queued or running job
+    gets that job instead of a new one.
+    The attempts themselves run in the door unlocker, which owns the camera, microphone
+    and serial port: each job asks for one on its local socket (socket_path) and stays
+    queued until the unlocker starts it, after any attempt for another method.
+    on_change(job) is called on the event loop whenever a job changes status.
+    """
+
+    def __init__(self, socket_path=UNLOCK_SOCKET, on_change=None, history=JOB_HISTORY):
+        self.socket_path = socket_path
+        self.on_change = on_change
+        self.history = history
+        self.jobs = OrderedDict()  # Job id -> job, oldest first
+        self.active = {}  # Method -> its queued or running job
+
+    def submit(self, method):
+        """Queue an attempt, or return the one already queued or running; returns (job, deduplicated)"""
+        job = self.active.get(method)
+        if job is not None:
+            return job, True
+        job = UnlockJob(method)
+        self.jobs[job.id] = job
+        self.active[method] = job
+        self.forget_old_jobs()
+        self.notify(job)
+        job.task = asyncio.get_running_loop().create_task(self.run(job))
+        return job, False
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def notify(self, job):
+        if self.on_change is not None:
+            self.on_change(job)
+
+    async def run(self, job):
+        writer = None
+        try:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError as e:
+                raise RuntimeError(f"door unlocker not reachable: {e}")
+            writer.write(json.dumps({"method": job.method}).encode() + b"\n")
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise RuntimeError("door unlocker closed the connection")
+                message = json.loads(line)
+                if message["status"] == "running":
+                    job.update("running", started=time.time())
+                    self.notify(job)
+                    continue
+                job.update(message["status"], finished=time.time(),
+                           credential_id=message.get("credential_id"), error=message.get("error"))
+                break
+        except asyncio.CancelledError:
+            job.update("failed", finished=time.time(), error="cancelled")
+        except Exception as e:
+            print(f"{job.method} unlock job failed: {e}")
+            job.update("failed", finished=time.time(), error=str(e))
+        finally:
+            if writer is not None:
+                writer.close()
+            del self.active[job.method]
+        self.notify(job)
+
+    def cancel_all(self):
+        """Stop waiting for the door unlocker, e.g. on shutdown; its attempts run on"""
+        for job in self.active.values():
+            job.task.cancel()
+
+    async def stream(self, job):
+        """Server-Sent Events with the job's state now and after every change, ending once it is done"""
+        while True:
+            # Taken together before yielding: the job may change while the event is sent,
+            # and that change must still be streamed
+            state, changed = job.to_dict(), job.changed
+            yield f"event: unlock_job\ndata: {json.dumps(state)}\n\n"
+            if state["status"] in FINISHED:
+                return
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
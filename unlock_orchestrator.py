@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+from metrics import UNLOCK_STAGE_SECONDS
+from serial_reader import SerialReader
+import tracing
+
+# Configuration
+ACK_TIMEOUT = 5.0  # Seconds to wait for the Arduino; OPEN_DOOR takes about 2.1 s, ERROR 2.3 s
+# Line the Arduino answers each command with once it has finished carrying it out
+ACKNOWLEDGEMENTS = {"OPEN_DOOR": "DOOR_OPENED", "ERROR": "ERROR"}
+# Local socket other processes (main.py) request unlock attempts on
+UNLOCK_SOCKET = os.environ.get("DOOR_UNLOCK_SOCKET", os.path.join(tempfile.gettempdir(), "door_unlocker.sock"))
+
+SERIAL_RECEIPT_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="serial_receipt")
+OPEN_DOOR_SEND_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="open_door_send")
+LOCK_ACK_SECONDS = UNLOCK_STAGE_SECONDS.labels(stage="lock_ack")
+
+
+class LoopQueue:
+    """Lets a thread put() onto an asyncio.Queue owned by an event loop"""
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class UnlockAttempt:
+    def __init__(self, method, started):
+        self.method = method
+        self.started = started
+        self.stop_event = threading.Event()  # Tells the sensing function to give up
+        self.task = None
+        self.unlocked = None  # Set with credential_id once the sensing function has decided
+        self.credential_id = None
+
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def cancel(self):
+        self.stop_event.set()
+        self.task.cancel()
+
+
+class UnlockOrchestrator:
+    """
+    Runs the unlock attempts requested over the serial port as asyncio tasks.
+
+    methods maps each request line to (method name, sensing function). The sensing
+    function runs on an executor thread, takes a threading.Event that is set when the
+    attempt is cancelled, and returns (unlocked, credential id).
+    A request for the method already running joins that attempt; a request for another
+    method cancels it and starts the new one once its sensing function has returned.
+    The serial port is read the whole time, and commands to the Arduino wait for its
+    acknowledgement instead of a fixed sleep, so the next request is served as soon as
+    the lock reports done.
+    on_result(method, unlocked, started, credential_id) is called for every attempt
+    that runs to completion.
+    Other processes request attempts on the local socket socket_path (see serve_remote),
+    so this process stays the only one using the camera and microphone.
+    """
+
+    def __init__(self, ser, methods, on_result=None, ack_timeout=ACK_TIMEOUT, socket_path=UNLOCK_SOCKET):
+        self.ser = ser
+        self.methods = methods
+        self.on_result = on_result
+        self.ack_timeout = ack_timeout
+        self.socket_path = socket_path
+        self.attempt = None
+        self.worker = None  # Future of the latest sensing function on its executor thread
+        self.waiting_acks = {}  # Acknowledgement line -> futures waiting for it, oldest first
+        self.command_lock = None  # One command to the Arduino at a time
+        self.loop = None
+
+    async def run(self):
+        """Serve requests until the serial port closes"""
+        self.loop = asyncio.get_running_loop()
+        self.command_lock = asyncio.Lock()
+        lines = asyncio.Queue()
+        reader = SerialReader(self.ser, LoopQueue(self.loop, lines))
+        reader.start()
+        server = None
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)  # Left behind by an earlier run
+            server = await asyncio.start_unix_server(self.serve_remote, path=self.socket_path)
+        try:
+            while True:
+                line, received_at = await lines.get()
+                if line is None:
+                    break  # The port went away
+                self.line_received(line, received_at)
+        finally:
+            reader.stop()
+            if server is not None:
+                server.close()
+                os.remove(self.socket_path)
+            if self.attempt is not None and self.attempt.running():
+                self.attempt.cancel()
+
+    def line_received(self, line, received_at):
+        waiting = self.waiting_acks.get(line)
+        if waiting:
+            waiting.pop(0).set_result(received_at)
+            return
+        if line not in self.methods:
+            return  # Late acknowledgements and other chatter
+        SERIAL_RECEIPT_SECONDS.observe(time.time() - received_at)
+        self.request(line, received_at)
+
+    def request(self, line, started=None):
+        """Start the attempt a request line asks for, or join the one already running it"""
+        method, function = self.methods[line]
+        previous = self.attempt
+        if previous is not None and previous.running():
+            if previous.method == method:
+                print(f"{method} unlock already in progress")
+                return previous
+            print(f"{method} unlock requested, cancelling {previous.method} unlock")
+            previous.cancel()
+
+        attempt = UnlockAttempt(method, started or time.time())
+        attempt.task = asyncio.create_task(self.run_attempt(attempt, function))
+        self.attempt = attempt
+        return attempt
+
+    async def run_attempt(self, attempt, function):
+        # Sensing functions share devices and module state, so a cancelled one must
+        # finish before the next starts
+        while self.worker is not None and not self.worker.done():
+            await asyncio.wait({self.worker})
+
+        with tracing.span("unlock_attempt", method=attempt.method):
+            self.worker = self.loop.run_in_executor(None, function, attempt.stop_event)
+            try:
+                # Shielded so the worker future only completes when the thread really has
+                unlocked, credential_id = await asyncio.shield(self.worker)
+            except Exception as e:
+                print(f"{attempt.method} unlock failed: {e}")
+                unlocked, credential_id = False, None
+            attempt.unlocked, attempt.credential_id = unlocked, credential_id
+
+            if self.on_result is not None:
+                self.on_result(attempt.method, unlocked, attempt.started, credential_id)
+            # Once decided, the door is driven to the end even if another request comes in
+            await asyncio.shield(self.send_command("OPEN_DOOR" if unlocked else "ERROR"))
+        return unlocked
+
+    async def serve_remote(self, reader, writer):
+        """
+        One remote attempt on the local socket: reads a {"method": ...} line, answers
+        {"status": "running"} once the attempt has started and then its result, as
+        {"status": "unlocked" or "denied", "credential_id": ...} or {"status": "failed",
+        "error": ...}. The result drives the door like a button press does. Unlike a
+        button press, it waits for an attempt for another method instead of cancelling it.
+        """
+        try:
+            method = json.loads(await reader.readline()).get("method")
+            line = next((line for line, (name, function) in self.methods.items() if name == method), None)
+            if line is None:
+                result = {"status": "failed", "error": f"unknown method '{method}'"}
+            else:
+                while self.attempt is not None and self.attempt.running() and self.attempt.method != method:
+                    await asyncio.wait({self.attempt.task})
+                attempt = self.request(line)
+                writer.write(json.dumps({"status": "running"}).encode() + b"\n")
+                await writer.drain()
+                try:
+                    await asyncio.shield(attempt.task)
+                    result = {"status": "unlocked" if attempt.unlocked else "denied",
+                              "credential_id": attempt.credential_id}
+                except asyncio.CancelledError:
+                    if not attempt.task.cancelled():
+                        raise  # This connection is being shut down, not the attempt
+                    result = {"status": "failed", "error": "cancelled by another unlock request"}
+                except Exception as e:
+                    result = {"status": "failed", "error": str(e)}
+            writer.write(json.dumps(result).encode() + b"\n")
+            await writer.drain()
+        except (ConnectionError, ValueError, AttributeError) as e:
+            print(f"Bad remote unlock request: {e}")
+        finally:
+            writer.close()
+
+    async def send_command(self, command):
+        """Write a command to the Arduino and wait for its acknowledgement; False on timeout"""
+        ack = ACKNOWLEDGEMENTS[command]
+        async with self.command_lock:
+            future = self.loop.create_future()
+            self.waiting_acks.setdefault(ack, []).append(future)
+            try:
+                sent_at = time.perf_counter()
+                with tracing.span(f"{command.lower()}_send"):
+                    await self.loop.run_in_executor(None, self.write_line, command)
+                if command == "OPEN_DOOR":
+                    OPEN_DOOR_SEND_SECONDS.observe(time.perf_counter() - sent_at)
+                with LOCK_ACK_SECONDS.time(), tracing.span("lock_ack", command=command):
+                    await asyncio.wait_for(future, self.ack_timeout)
+                return True
+            except asyncio.TimeoutError:
+                print(f"Error: No {ack} from Arduino")
+                return False
+            finally:
+                if future in self.waiting_acks[ack]:
+                    self.waiting_acks[ack].remove(future)
+
+    def write_line(self, command):
+        self.ser.write(command.encode() + b"\n")
+        self.ser.flush()